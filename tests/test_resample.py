@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from vini.resample import resample_image, resample_generic, \
+    resample_separable, get_axis_permutation
+
+
+def random_axis_aligned_affine(rng):
+    """
+    Returns an affine that scales, flips, swaps and translates the axes and
+    its axis permutation.
+    """
+    perm = rng.permutation(3)
+    affine = np.eye(4)
+    affine[0:3,0:3] = 0
+    for i in range(3):
+        # integer steps, simple and arbitrary ratios, flips
+        scale = rng.choice([1, 2, 0.5, 0.25, 1.5, rng.uniform(0.1, 3)])
+        affine[i,perm[i]] = scale*rng.choice([-1, 1])
+    # integer, half voxel and arbitrary offsets
+    affine[0:3,3] = (rng.choice([0, 3, -2, 0.5, 12.5], 3) +
+                     rng.choice([0, 1], 3)*rng.uniform(-4, 14, 3))
+    return affine, list(perm)
+
+def compare(data, affine, shape, interpolation, perm):
+    fast = resample_separable(
+        data, affine, shape, interpolation, perm, np.empty(tuple(shape)))
+    generic = resample_generic(data, affine, shape, interpolation)
+    return fast, generic
+
+
+@pytest.mark.parametrize('interpolation', [0, 1])
+@pytest.mark.parametrize('seed', range(20))
+def test_separable_matches_generic(interpolation, seed):
+    rng = np.random.RandomState(seed)
+    data = rng.randn(13, 11, 9)
+    for k in range(10):
+        [affine, perm] = random_axis_aligned_affine(rng)
+        shape = rng.randint(1, 20, 3)
+        [fast, generic] = compare(data, affine, shape, interpolation, perm)
+        if interpolation == 0:
+            np.testing.assert_array_equal(fast, generic)
+        else:
+            np.testing.assert_allclose(fast, generic, atol=1e-10)
+
+@pytest.mark.parametrize('interpolation', [0, 1])
+def test_flipped_affines(interpolation):
+    data = np.random.RandomState(1).randn(10, 12, 8)
+    for flips in [(-1, 1, 1), (1, -1, 1), (1, 1, -1), (-1, -1, -1)]:
+        affine = np.diag(list(flips) + [1]).astype(float)
+        affine[0:3,3] = [n-1 if f < 0 else 0
+                         for [f, n] in zip(flips, data.shape)]
+        perm = get_axis_permutation(affine[0:3,0:3])
+        assert perm == [0, 1, 2]
+        [fast, generic] = compare(data, affine, (10, 12, 8), interpolation,
+                                  perm)
+        np.testing.assert_allclose(fast, generic, atol=1e-10)
+        if flips == (-1, -1, -1):
+            np.testing.assert_array_equal(fast, data[::-1, ::-1, ::-1])
+
+@pytest.mark.parametrize('interpolation', [0, 1])
+def test_oblique_affines_use_generic(interpolation):
+    rng = np.random.RandomState(2)
+    data = rng.randn(12, 10, 9)
+    angle = np.pi/7
+    rotation = np.array([[np.cos(angle), -np.sin(angle), 0],
+                         [np.sin(angle), np.cos(angle), 0],
+                         [0, 0, 1]])
+    affine = np.eye(4)
+    affine[0:3,0:3] = np.dot(rotation, np.diag([1.0, -0.5, 2.0]))
+    affine[0:3,3] = [2.0, 8.5, -1.0]
+    assert get_axis_permutation(affine[0:3,0:3]) is None
+    result = resample_image(data, affine, (14, 15, 6), interpolation)
+    generic = resample_generic(data, affine, (14, 15, 6), interpolation)
+    np.testing.assert_allclose(result, generic, atol=1e-6)
+
+@pytest.mark.parametrize('interpolation', [0, 1])
+def test_resample_image_uses_separable_path(interpolation):
+    rng = np.random.RandomState(3)
+    data = rng.randn(13, 11, 9)
+    [affine, perm] = random_axis_aligned_affine(rng)
+    result = resample_image(data, affine, (15, 8, 12), interpolation)
+    generic = resample_generic(data, affine, (15, 8, 12), interpolation)
+    np.testing.assert_allclose(result, generic, atol=1e-6)
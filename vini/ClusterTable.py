@@ -0,0 +1,113 @@
+from .pyqtgraph_vini.Qt import QtCore, QtGui
+
+
+class ClusterTable(QtGui.QWidget):
+    """
+    Lists the clusters of the selected image beyond its thresholds (see
+    ClusterTree). Selecting a row moves the crosshair to the peak of the
+    cluster.
+    """
+
+    # peak of the selected cluster (resampled voxel coordinates)
+    sigClusterSelected = QtCore.Signal(object)
+
+    def __init__(self, max_rows=500):
+        super(ClusterTable, self).__init__()
+
+        self.resize(560, 400)
+        self.setWindowTitle("Clusters")
+
+        # only the largest clusters of each sign are listed
+        self.max_rows = max_rows
+        # peaks of the rows
+        self.peaks = []
+        # clusters currently listed
+        self.clusters = None
+
+        self.l = QtGui.QVBoxLayout()
+        self.setLayout(self.l)
+
+        self.title_lbl = QtGui.QLabel("")
+        self.l.addWidget(self.title_lbl)
+
+        self.table = QtGui.QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(
+            ["Voxels", "Peak value", "Peak at", "Mean", "Centroid"])
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(
+            QtGui.QAbstractItemView.SingleSelection)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.currentCellChanged.connect(self.selectCluster)
+        self.l.addWidget(self.table)
+
+        self.count_lbl = QtGui.QLabel("")
+        self.l.addWidget(self.count_lbl)
+
+        self.close_view = QtGui.QAction('close view', self)
+        self.close_view.setShortcut(QtGui.QKeySequence.Quit)
+        self.close_view.triggered.connect(self.close)
+        self.addAction(self.close_view)
+
+    def setTitle(self, title):
+        self.title_lbl.setText("<b>Clusters: {}</b>".format(title))
+
+    def setClusters(self, clusters, transform):
+        """
+        Lists the clusters, a list of the results of ClusterTree.getClusters
+        (positive and negative clusters). transform maps voxel coordinates
+        to the displayed coordinates.
+        """
+        if (self.clusters is not None and len(clusters) == len(self.clusters)
+                and all(c is o for [c, o] in zip(clusters, self.clusters))):
+            return
+        self.clusters = clusters
+        self.peaks = []
+        rows = []
+        total = 0
+        for cl in clusters:
+            total += len(cl['size'])
+            for i in range(min(len(cl['size']), self.max_rows)):
+                self.peaks.append(cl['peak'][i])
+                rows.append([
+                    str(cl['size'][i]),
+                    "{:.4g}".format(cl['peak_value'][i]),
+                    formatCoord(transform(cl['peak'][i])),
+                    "{:.4g}".format(cl['mean'][i]),
+                    formatCoord(transform(cl['centroid'][i]))])
+
+        self.table.blockSignals(True)
+        self.table.clearContents()
+        self.table.setRowCount(len(rows))
+        for [row, texts] in enumerate(rows):
+            for [column, text] in enumerate(texts):
+                item = QtGui.QTableWidgetItem(text)
+                item.setTextAlignment(
+                    QtCore.Qt.AlignVCenter | QtCore.Qt.AlignRight)
+                self.table.setItem(row, column, item)
+        self.table.blockSignals(False)
+        self.table.resizeColumnsToContents()
+
+        if len(rows) < total:
+            self.count_lbl.setText(
+                "{} clusters, the largest {} listed".format(total, len(rows)))
+        else:
+            self.count_lbl.setText("{} clusters".format(total))
+
+    def clear(self):
+        self.setClusters([], None)
+
+    def selectCluster(self, row, column, prev_row, prev_column):
+        if 0 <= row < len(self.peaks):
+            self.sigClusterSelected.emit(
+                [int(c) for c in self.peaks[row]])
+
+    def closeEvent(self, ev):
+        self.hide()
+
+
+def formatCoord(coord):
+    return ", ".join(
+        "{:.1f}".format(c) if c != int(c) else str(int(c))
+        for c in coord[0:3])
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class ClusterTree(object):
+    """
+    Finds the clusters (26-connected components) of the voxels of a volume
+    above a threshold (or below it for minima) and their statistics.
+
+    The voxels beyond the base threshold are sorted once, strongest first,
+    together with the edges between neighboring voxels. The voxels beyond
+    any stricter threshold are a prefix of this list and the edges between
+    them are a prefix of the edges, so moving the threshold only joins the
+    components of this prefix instead of labeling the whole volume again.
+    For more than max_voxels voxels the edges would take too much memory,
+    then the volume is labeled for every threshold.
+    """
+
+    def __init__(self, data, threshold, maxima=True, max_voxels=250000):
+        data = np.asarray(data)
+        self.shape = data.shape
+        self.threshold = threshold
+        self.maxima = maxima
+        if maxima:
+            mask = data > threshold
+        else:
+            mask = data < threshold
+        coords = np.argwhere(mask)
+        values = data[mask]
+        order = np.argsort(values, kind='stable')
+        if maxima:
+            order = order[::-1]
+        self.coords = coords[order]
+        self.values = values[order]
+        self.ascending = np.sort(values)
+        self.edges = None
+        self.edge_levels = None
+        if len(self.values) <= max_voxels:
+            self.edges = self.computeEdges(mask)
+
+    def computeEdges(self, mask):
+        """
+        Returns the pairs of ranks of neighboring voxels in the order in
+        which they are joined when lowering (raising) the threshold.
+        """
+        rank = np.empty(self.shape, dtype=np.int32)
+        rank.fill(-1)
+        rank[tuple(self.coords.T)] = np.arange(len(self.coords))
+        first = []
+        second = []
+        # every neighbor once: the 13 offsets that come later in C order
+        for offset in np.ndindex(3, 3, 3):
+            offset = np.asarray(offset) - 1
+            if tuple(offset) <= (0, 0, 0):
+                continue
+            src = tuple(slice(max(0, -o), n - max(0, o))
+                        for [o, n] in zip(offset, self.shape))
+            dst = tuple(slice(max(0, o), n - max(0, -o))
+                        for [o, n] in zip(offset, self.shape))
+            both = np.logical_and(mask[src], mask[dst])
+            first.append(rank[src][both])
+            second.append(rank[dst][both])
+        first = np.concatenate(first)
+        second = np.concatenate(second)
+        # an edge exists as soon as both voxels are beyond the threshold
+        levels = np.maximum(first, second)
+        order = np.argsort(levels, kind='stable')
+        self.edge_levels = levels[order]
+        return [first[order], second[order]]
+
+    def covers(self, threshold):
+        """
+        Returns whether the clusters for the threshold can be computed.
+        """
+        if self.maxima:
+            return threshold >= self.threshold
+        return threshold <= self.threshold
+
+    def getClusters(self, threshold):
+        """
+        Returns the clusters for a threshold covered by the tree as dict of
+        arrays, the largest cluster first: 'size' (voxels), 'peak' (voxel
+        coordinates), 'peak_value', 'centroid' and 'mean'.
+
+        The tree isn't changed, so this can run in several threads.
+        """
+        n = len(self.values)
+        if self.maxima:
+            k = n - np.searchsorted(self.ascending, threshold, side='right')
+        else:
+            k = np.searchsorted(self.ascending, threshold, side='left')
+        if k == 0:
+            labels = np.zeros(0, dtype=np.intp)
+        elif self.edges is not None:
+            m = np.searchsorted(self.edge_levels, k)
+            graph = coo_matrix(
+                (np.ones(m, dtype=np.int8),
+                 (self.edges[0][:m], self.edges[1][:m])), shape=(k, k))
+            labels = connected_components(graph, directed=False)[1]
+        else:
+            labels = self.labelVoxels(k)
+        return computeClusterStats(labels, self.values[:k], self.coords[:k])
+
+    def labelVoxels(self, k):
+        """
+        Returns the component of each of the k strongest voxels by labeling
+        the volume.
+        """
+        coords = tuple(self.coords[:k].T)
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[coords] = True
+        volume = ndimage.label(mask, structure=np.ones((3, 3, 3)))[0]
+        return volume[coords] - 1
+
+
+def computeClusterStats(labels, values, coords):
+    """
+    Returns the statistics of the clusters (see ClusterTree.getClusters) of
+    the voxels with the given component labels, values and coordinates. The
+    voxels have to be sorted strongest first.
+    """
+    # the first voxel of every component is its peak
+    [ids, first] = np.unique(labels, return_index=True)
+    n = len(ids)
+    size = np.bincount(labels, minlength=n)
+    mean = np.bincount(labels, weights=values, minlength=n) / size
+    centroid = np.empty((n, 3))
+    for axis in range(3):
+        centroid[:,axis] = np.bincount(
+            labels, weights=coords[:,axis], minlength=n) / size
+    order = np.argsort(-size, kind='stable')
+    return {
+        'size': size[order],
+        'peak': coords[first[order]],
+        'peak_value': values[first[order]],
+        'centroid': centroid[order],
+        'mean': mean[order]}
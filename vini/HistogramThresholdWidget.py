@@ -30,6 +30,9 @@ class HistogramThresholdWidget(GraphicsWindow):
         color.setRgb(0, 0, 170, 40)
         self.brush = mkBrush(color)
 
+        # Histogram curve, its data is replaced for new histograms.
+        self.curve = None
+
         # Line regions
         self.lr_pos = None
         self.lr_neg = None
@@ -58,17 +61,22 @@ class HistogramThresholdWidget(GraphicsWindow):
     def setPlot(self, x, y):
         """
         Resets plot to given arrays.
+
+        The curve is only created once, afterwards its data is replaced.
         """
-        self.plot.clear()
-        self.plot.plot(x, y, pen='k')
+        if self.curve is None:
+            self.curve = self.plot.plot(x, y, pen='k')
+        else:
+            self.curve.setData(x, y)
 
     def LineRegionPos(self, low, high):
         """
-        Initializes the line region tool for the positive color map.
+        Initializes the line region tool for the positive color map or moves
+        the existing one.
         """
         if self.lr_pos is not None:
-            self.plot.removeItem(self.lr_pos)
-            self.lr_pos = None
+            self.lr_pos.setRegion([low, high])
+            return
         self.lr_pos = LinearRegionItem(brush=self.brush, values=[low,high])
         self.lr_pos.setZValue(-1)
         self.lr_pos.setMovable(False)
@@ -77,11 +85,12 @@ class HistogramThresholdWidget(GraphicsWindow):
 
     def LineRegionNeg(self, low, high):
         """
-        Initializes the line region tool for the negative color map.
+        Initializes the line region tool for the negative color map or moves
+        the existing one.
         """
         if self.lr_neg is not None:
-            self.plot.removeItem(self.lr_neg)
-            self.lr_neg = None
+            self.lr_neg.setRegion([low, high])
+            return
         self.lr_neg = LinearRegionItem(brush=self.brush, values=[low,high])
         self.lr_neg.setZValue(-1)
         self.lr_neg.setMovable(False)
@@ -108,6 +117,9 @@ class HistogramThresholdWidget(GraphicsWindow):
         if self.lr_pos is not None:
             self.plot.removeItem(self.lr_pos)
             self.lr_pos = None
+        self.removeLineRegionNeg()
+
+    def removeLineRegionNeg(self):
         if self.lr_neg is not None:
             self.plot.removeItem(self.lr_neg)
             self.lr_neg = None
@@ -7,6 +7,8 @@ from nibabel.affines import apply_affine
 from nibabel.volumeutils import shape_zoom_affine
 from nibabel import Nifti1Image
 import copy
+import functools
+import itertools
 
 from .pyqtgraph_vini import *
 from .pyqtgraph_vini.colormap import ColorMap
@@ -14,7 +16,14 @@ from .pyqtgraph_vini.colormap import ColorMap
 from .ImageItemMod import *
 from .ColorMapWidget import *
 from .ImageDialog import *
-from .resample import resample_image
+from .SliceColorizer import SliceColorizer, quantizationGrid, \
+    quantizedValues, quantize
+from .resample import resample_image, resample_plane, resample_slab, \
+    split_slabs, resampled_dtype
+from .pyqtgraph_vini.util.lru_cache import LRUCache
+from .imageStats import computeHistogram
+from .peakSearch import searchCube, findExtremum, findPeaks
+from .ClusterTree import ClusterTree
 from .quaternions import fillpositive, quat2mat, mat2quat
 
 # try:
@@ -29,12 +38,17 @@ class Image(object):
     dimensional images.
     """
 
+    # gives every image a distinct id for the resampling cache
+    cache_ids = itertools.count()
+
     def __init__(self, filename=None):
 
         # filename string
         self.image_path = filename
         # image object, Nifti1Image
         self.image = None
+        # data array of the image (a np.memmap for lazily loaded files)
+        self.image_data = None
         # affine used for coordinate system
         self.affine_used = None
         # resample image data
@@ -46,6 +60,11 @@ class Image(object):
         self.affine_res_inv = None
         # 0 for nearest and 1 for linear
         self.interp_type = 0
+        # Only resample the displayed slices instead of the whole volume.
+        self.on_demand = False
+        # Resampled slices, keyed by (plane, index, interpolation, frame,
+        # affine, shape).
+        self.slice_cache = LRUCache(maxSize=30, resizeTo=15)
         
         #sform code
         self.sform_code = -1
@@ -62,15 +81,38 @@ class Image(object):
         # Coordinates of the image slices.
         self.coord = [0,0,0]
         self.two_cm = True
-        self.image_slices_pos = [None, None, None]
-        self.image_slices_neg = [None, None, None]
         self.image_slices = [None, None, None]
+        # What the colored slices were computed with, see getSliceKey, and
+        # how often each of them was recomputed.
+        self.slice_keys = [None, None, None]
+        self.slice_versions = [0, 0, 0]
+        # Pyramid levels requested for each plane and those of the colored
+        # slices: level l has every 2**l-th voxel of the slice.
+        self.slice_levels = [0, 0, 0]
+        self.image_levels = [0, 0, 0]
+        # Incremented when the colormaps or the resampled data change.
+        self.lut_version = 0
+        self.res_version = 0
+
+        # Quantized mode: the resampled volume is also kept as uint16 codes,
+        # so that changing thresholds or colormaps only recomputes a table
+        # with an entry for every code.
+        self.quantized = False
+        self.image_quant = None
+        self.quant_grid = None
+        self.quant_table = None
+        self.quant_table_key = None
+        # Applies the colormaps to the slices (with buffers for each plane).
+        self.colorizer = SliceColorizer(bgra=True)
 
         self.threshold_pos = [0.0, 0.0]
         self.threshold_neg = [0.0, 0.0]
         self.cmap_pos = None
         self.cmap_neg = None
-        self.hist_saved = False
+        # histograms of the resampled volumes, keyed by getResampleKey
+        self.hist_cache = LRUCache(maxSize=64, resizeTo=32)
+        # extrema, peak lists and cluster trees, keyed like the histograms
+        self.peak_cache = LRUCache(maxSize=64, resizeTo=32)
 
         # Has to be kept up to date when resampling or changing frame (4D).
         self.extremum = [0, 0]
@@ -106,6 +148,12 @@ class Image(object):
         
         self.xhairval = -1
 
+        # TaskScheduler of the viewer for background computations
+        self.scheduler = None
+        # ResampleCache of the viewer
+        self.res_cache = None
+        self.cache_id = next(Image.cache_ids)
+
         if filename is not None:
             self.loadImage(filename)
 
@@ -126,6 +174,7 @@ class Image(object):
         Creates image from given numpy array and affine (4x4 numpy array)
         """
         self.image = Nifti1Image(image_data, affine)
+        self.image_data = image_data
         self.resample()
 
     def getBounds(self):
@@ -171,11 +220,33 @@ class Image(object):
         out[0:3, 3] = [quats[3], quats[4], quats[5]]
         return out
 
+    def getData(self):
+        """
+        Returns the data array of the image.
+
+        For lazily loaded files this is the memory-mapped array behind
+        nibabel's array proxy, so voxels are only read when accessed.
+        """
+        if self.image_data is None:
+            self.image_data = np.asanyarray(self.image.dataobj)
+        return self.image_data
+
+    def getFrameData(self, frame=None):
+        """
+        Returns the volume that is resampled. Overwritten for 4D images.
+        """
+        return self.getData()
+
+    def getFrame(self):
+        return 0
+
     def getOriginalDimensions(self):
-        return self.image.get_data().shape
+        return self.image.shape
 
     def getDimensions(self):
-        return self.image_res.shape
+        if self.image_res is not None:
+            return self.image_res.shape[0:3]
+        return tuple(np.asarray(self.res_shape).astype(int))
 
     def updateCoordinates(self, coord=[0, 0, 0]):
         """
@@ -289,9 +360,45 @@ class Image(object):
         else:
             return int(self.threshold_neg[1]/tick_length)
 
+    def setScheduler(self, scheduler):
+        self.scheduler = scheduler
+
+    def setResampleCache(self, res_cache):
+        self.res_cache = res_cache
+
     def setInterpolation(self, interp_type):
         self.interp_type = interp_type
 
+    def setQuantized(self, state):
+        """
+        Sets whether slices are colored from quantized codes.
+        """
+        self.quantized = state
+        # quantize only resampled volumes
+        if self.affine_res_inv is not None:
+            self.setResampled(self.image_res)
+
+    def getQuantizedTable(self):
+        """
+        Returns the color table (BGRA like the slices) for the quantized
+        codes with the current thresholds and colormaps.
+        """
+        key = (self.lut_version, tuple(self.threshold_pos),
+               tuple(self.threshold_neg), self.two_cm, self.quant_grid)
+        if key != self.quant_table_key:
+            values = quantizedValues(self.quant_grid)
+            self.quant_table = \
+                self.colorSlice(values[np.newaxis,:]).reshape(-1, 4)
+            self.quant_table_key = key
+        return self.quant_table
+
+    def setOnDemand(self, state):
+        """
+        Sets whether only the displayed slices are resampled.
+        """
+        self.on_demand = state
+        self.slice_cache.clear()
+
     def presetCMPos(self, name):
         """
         Loads a predefined positive colormap with the name name.
@@ -316,31 +423,181 @@ class Image(object):
         Resamples the image to 'shape' with the transformation 'affine'
         overwriting its own transformation with 'over_affine'.
         """
+        self.setResampleOverAffine(shape, t_affine, over_affine)
+        self.reresample()
+
+    def resample(self, shape, affine):
+        """
+        Resamples the image to 'shape' with the transformation 'affine'.
+        """
+        self.setResampleAffine(shape, affine)
+        self.reresample()
+
+    def setResampleOverAffine(self, shape, t_affine, over_affine):
+        """
+        Sets the resampling like resample_overaffine without resampling.
+        """
         self.affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
-        self.image_res = resample_image(
-            self.image.get_data(), affine=self.affine_res_inv,
-            shape=shape, interpolation=self.interp_type)
         self.res_shape = shape
         self.state_affine_over = True
 
-    def resample(self, shape, affine):
+    def setResampleAffine(self, shape, affine):
         """
-        Resamples the image to 'shape' with the transformation 'affine'.
+        Sets the resampling like resample without resampling.
         """
         self.affine_res_inv = np.dot(np.linalg.inv(self.image.affine), affine)
-        self.image_res = resample_image(
-            self.image.get_data(), affine=self.affine_res_inv,
-            shape=shape, interpolation=self.interp_type)
         self.res_shape = shape
         self.state_affine_over = False
 
+    def getResampleJobs(self, n_slabs=1):
+        """
+        Returns the array for the resampled volume and a list of functions,
+        each resampling one z-slab into it.
+
+        The functions don't touch the image and can run in other threads.
+        The result is set with commitResampled when all of them are done.
+        """
+        data = self.getFrameData()
+        shape = tuple(np.asarray(self.res_shape).astype(int))
+        result = np.empty(
+            shape, dtype=resampled_dtype(data.dtype, self.interp_type))
+        jobs = []
+        for start, stop in split_slabs(shape, n_slabs):
+            jobs.append(functools.partial(
+                resample_slab, data, np.copy(self.affine_res_inv), shape,
+                self.interp_type, start, stop, result))
+        return result, jobs
+
+    def commitResampled(self, image_res):
+        """
+        Sets the resampled volume computed by the jobs of getResampleJobs.
+
+        With None the slices are resampled on demand.
+        """
+        if image_res is not None and self.res_cache is not None:
+            self.res_cache.put(self.getCacheKey(), image_res)
+        self.setResampled(image_res)
+        self.slice_cache.clear()
+
+    def getCacheKey(self):
+        """
+        Returns the key of the resampled volume in the resampling cache.
+        """
+        return (self.cache_id,) + self.getResampleKey()
+
+    def getCachedResampled(self):
+        """
+        Returns the resampled volume from the resampling cache or None.
+        """
+        if self.res_cache is None or self.affine_res_inv is None:
+            return None
+        return self.res_cache.get(self.getCacheKey())
+
+    def setResampled(self, image_res):
+        """
+        Sets the resampled volume and its quantized codes.
+        """
+        self.image_res = image_res
+        self.image_quant = None
+        if self.quantized and image_res is not None:
+            self.quant_grid = quantizationGrid(
+                self.extremum[0], self.extremum[1])
+            if self.quant_grid is not None:
+                self.image_quant = quantize(image_res, self.quant_grid)
+        self.res_version += 1
+
     def reresample(self):
         """
         Resamples with already given affine.
+
+        In on demand mode only the affine is kept and the slices are
+        resampled when they are displayed.
+        """
+        self.setResampled(None)
+        self.slice_cache.clear()
+        if not self.on_demand:
+            self.getResampledData()
+
+    def getResampledData(self):
         """
-        self.image_res = resample_image(
-            self.image.get_data(), affine=self.affine_res_inv,
-            shape=self.res_shape, interpolation=self.interp_type)
+        Returns the resampled volume.
+
+        In on demand mode the whole volume is only resampled here, e.g. for
+        the histogram or the search of extrema, and kept until the next
+        resampling.
+        """
+        if self.image_res is None and self.affine_res_inv is not None:
+            [key, source] = self.getResampledSource()
+            self.putResampled(key, source())
+        return self.image_res
+
+    def getResampledSource(self):
+        """
+        Returns the cache key of the resampled volume and a function that
+        returns the volume, resampling it if necessary.
+
+        The function only uses what is taken from the image here, so it can
+        run in a worker thread while the image changes (e.g. its frame). Its
+        result is handed back to putResampled on the main thread.
+        """
+        key = self.getCacheKey()
+        volume = self.image_res
+        if volume is None:
+            volume = self.getCachedResampled()
+        if volume is not None or self.affine_res_inv is None:
+            return [key, lambda: volume]
+        return [key, functools.partial(
+            resample_image, self.getFrameData(),
+            affine=np.copy(self.affine_res_inv),
+            shape=tuple(np.asarray(self.res_shape).astype(int)),
+            interpolation=self.interp_type)]
+
+    def putResampled(self, key, volume):
+        """
+        Keeps a volume returned by the function of getResampledSource if it
+        is still the resampled volume of the image.
+        """
+        if volume is None or key != self.getCacheKey():
+            return
+        if self.image_res is None:
+            if self.res_cache is not None:
+                self.res_cache.put(key, volume)
+            self.setResampled(volume)
+
+    def getSlice(self, plane, index, level=0):
+        """
+        Returns the resampled slice 'index' along the axis 'plane' at the
+        pyramid 'level'.
+
+        If the resampled volume is not available the slice is resampled
+        from the original data and cached. Coarser levels are resampled
+        directly on their coarser grid then.
+        """
+        index = int(index)
+        step = 2**level
+        if self.image_res is not None:
+            sl = [slice(None, None, step)]*3
+            sl[plane] = index
+            return self.image_res[tuple(sl)]
+        key = (plane, index, level) + self.getResampleKey()
+        sliced = self.slice_cache.get(key)
+        if sliced is None:
+            sliced = resample_plane(
+                self.getFrameData(), affine=self.affine_res_inv,
+                shape=self.res_shape, plane=plane, index=index,
+                interpolation=self.interp_type, step=step)
+            self.slice_cache[key] = sliced
+        return sliced
+
+    def getResampleKey(self):
+        """
+        Returns what the resampled volume of the current frame depends on.
+        """
+        if self.affine_res_inv is None:
+            return (self.getFrame(), None)
+        return (self.getFrame(), self.interp_type,
+                self.affine_res_inv.tobytes(),
+                tuple(np.asarray(self.res_shape).astype(int)))
 
     def getAffine(self):
         return self.image.affine
@@ -363,7 +620,7 @@ class Image(object):
 
     def setUnresampled(self):
         # TODO: setze self.affine_res_inv = np.eye(4)?
-        self.image_res = self.image.get_data()
+        self.setResampled(self.getData())
 
     def setHistogram(self):
         c_hist = self.getHistogram()
@@ -372,7 +629,7 @@ class Image(object):
         """
         Slices through the resampled data cube and applies the colormaps.
         """
-        if self.image_res is None:
+        if self.image_res is None and self.affine_res_inv is None:
             return 0
         if coord is not None:
             self.coord = coord
@@ -380,74 +637,131 @@ class Image(object):
         if not self.state:
             return 0
 
-        [self.image_slices_pos[0], truth] = \
-            mymakeARGB(
-                self.image_res[int(self.coord[0]),:,:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            mymakeARGB(
-                self.image_res[:,int(self.coord[1]),:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            mymakeARGB(
-                self.image_res[:,:,int(self.coord[2])], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                mymakeARGB(
-                    self.image_res[int(self.coord[0]),:,:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                mymakeARGB(
-                    self.image_res[:,int(self.coord[1]),:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                mymakeARGB(
-                    self.image_res[:,:,int(self.coord[2])], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = \
-                self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = \
-                self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = \
-                self.image_slices_pos[2] + self.image_slices_neg[2]
-        else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
-
-    def mosaicSlice(self, plane, coord):
-        """
-        Returns slices for the mosaic view.
-        """
-        sliced = None
-        if plane == 's':
-            sliced = self.image_res[coord,:,:]
-        if plane == 'c':
-            sliced = self.image_res[:,coord,:]
-        if plane == 't':
-            sliced = self.image_res[:,:,coord]
-        [slice_rgba, truth] = mymakeARGB(
-            sliced, self.cmap_pos, levels=[self.threshold_pos[0],
-            self.threshold_pos[1]], useRGBA=True)
+        self.colorSlices()
+
+    def getSliceKey(self, plane):
+        """
+        Returns the values the colored slice of the plane depends on.
+        """
+        return (int(self.coord[plane]), self.getFrame(), self.res_version,
+                self.lut_version, tuple(self.threshold_pos),
+                tuple(self.threshold_neg), self.two_cm,
+                self.slice_levels[plane])
+
+    def colorSlices(self):
+        """
+        Colors the slices of the planes that changed since they were last
+        colored.
+        """
+        for i in range(3):
+            key = self.getSliceKey(i)
+            if key == self.slice_keys[i]:
+                continue
+            level = self.slice_levels[i]
+            if self.image_quant is not None:
+                # only a lookup of the codes in the table
+                sl = [slice(None, None, 2**level)]*3
+                sl[i] = int(self.coord[i])
+                self.image_slices[i] = self.colorizer.lookup(
+                    self.image_quant[tuple(sl)], self.getQuantizedTable(),
+                    plane=i)
+            else:
+                self.image_slices[i] = self.colorSlice(
+                    self.getSlice(i, self.coord[i], level), plane=i)
+            self.image_levels[i] = level
+            self.slice_keys[i] = key
+            self.slice_versions[i] += 1
+
+    def getSliceVersion(self, plane):
+        """
+        Identifies the current colored slice of the plane, e.g. to find out
+        whether an ImageItemMod displays it already.
+        """
+        return (self, plane, self.slice_versions[plane])
+
+    def setSliceLevels(self, levels):
+        """
+        Sets the pyramid levels at which the slices of the three planes are
+        colored, e.g. coarser ones if the views are zoomed out so far that
+        several voxels fall into one screen pixel.
+        """
+        self.slice_levels = list(levels)
+
+    def getSliceLevel(self, plane):
+        """
+        Returns the pyramid level of the current colored slice of the plane.
+        """
+        return self.image_levels[plane]
+
+    def getMosaicTask(self, plane, coords):
+        """
+        Returns a function returning the RGBA slices for the mosaic view at
+        the coordinates coords along plane ('s', 'c' or 't').
+
+        The function only uses what is taken from the image here, so it can
+        run in a worker thread.
+        """
+        axis = {'s': 0, 'c': 1, 't': 2}[plane]
+        params = self.getColorParams()
+        if self.image_res is not None:
+            return functools.partial(
+                self.renderMosaicSlices, self.image_res, None, None, None,
+                None, axis, coords, params)
+        return functools.partial(
+            self.renderMosaicSlices, None, self.getFrameData(),
+            np.copy(self.affine_res_inv),
+            tuple(np.asarray(self.res_shape).astype(int)), self.interp_type,
+            axis, coords, params)
+
+    def renderMosaicSlices(self, volume, data, affine, shape, interpolation,
+                           plane, coords, params):
+        """
+        Returns the RGBA slices of the resampled volume, or of data
+        resampled slice by slice if there is no volume.
+
+        Runs in a worker thread, so it only uses its arguments.
+        """
+        [lut_pos, levels_pos, lut_neg, levels_neg] = params
+        # own colorizer, the tables of a shared one would not be thread-safe
+        colorizer = SliceColorizer()
+        slices = []
+        for coord in coords:
+            if volume is not None:
+                sl = [slice(None)]*3
+                sl[plane] = int(coord)
+                sliced = volume[tuple(sl)]
+            else:
+                sliced = resample_plane(
+                    data, affine=affine, shape=shape, plane=plane,
+                    index=int(coord), interpolation=interpolation)
+            slices.append(colorizer.colorize(
+                sliced, lut_pos, levels_pos, lut_neg, levels_neg))
+        return slices
+
+    def colorSlice(self, sliced, plane=None, colorizer=None):
+        """
+        Applies thresholds and colormaps to a slice and returns the RGBA
+        array.
+
+        With a plane the buffer of the plane is reused, so the array is
+        only valid until this plane is colored again.
+        """
+        if colorizer is None:
+            colorizer = self.colorizer
+        [lut_pos, levels_pos, lut_neg, levels_neg] = self.getColorParams()
+        return colorizer.colorize(
+            sliced, lut_pos, levels_pos, lut_neg, levels_neg, plane=plane)
+
+    def getColorParams(self):
+        """
+        Returns colormaps and thresholds used to color slices. The negative
+        ones are None if only the positive colormap is used.
+        """
         if (self.two_cm and
                 float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            [slice_neg, truth] = mymakeARGB(
-                sliced, self.cmap_neg, levels=[self.threshold_neg[0],
-                self.threshold_neg[1]], useRGBA=True)
-            slice_rgba = np.add(slice_rgba, slice_neg)
-        return slice_rgba
+            return [self.cmap_pos, tuple(self.threshold_pos),
+                    self.cmap_neg, tuple(self.threshold_neg)]
+        return [self.cmap_pos, tuple(self.threshold_pos), None, None]
 
     def getImageArrays(self):
         return self.image_slices
@@ -464,6 +778,7 @@ class Image(object):
         if self.clippings_pos[1]:
             color_map = np.concatenate((color_map, alpha_out), axis=0)
         self.cmap_pos = color_map
+        self.lut_version += 1
         self.slice()
 
     def setColorMapNeg(self, color_map=None):
@@ -480,13 +795,14 @@ class Image(object):
         if self.clippings_neg[1]:
             color_map = np.concatenate((color_map, alpha_out), axis=0)
         self.cmap_neg = color_map
+        self.lut_version += 1
         self.slice()
 
     def useDiscreteCM(self):
         """
         Define colormap for discrete intensity values.
         """
-        value_set = np.unique(self.image.get_data())
+        value_set = np.unique(self.getData())
 
         value_set = np.subtract(value_set, value_set[0])
         value_set = np.multiply(value_set, 1./value_set[-1])
@@ -513,32 +829,67 @@ class Image(object):
         """
         Returns the intensity at the current coordinate.
         """
-        if coord is not None:
-            return self.image_res[int(coord[0]),int(coord[1]),int(coord[2])]
-        else:
-            return self.image_res[int(self.coord[0]),int(self.coord[1]),
-                                  int(self.coord[2])]
+        if coord is None:
+            coord = self.coord
+        return self.getSlice(2, coord[2])[int(coord[0]),int(coord[1])]
 
     def getHistogram(self, targetHistogramSize=500):
         """
         Returns a histogram (two arrays with bin values and bin positions) of
         the currently resampled image.
+
+        Histograms are cached for every frame and resampling.
+        """
+        [compute, commit] = self.getHistogramTask(targetHistogramSize)
+        return commit(compute())
+
+    def getHistogramTask(self, targetHistogramSize=500):
+        """
+        Returns two functions: compute returns the histogram (see
+        getHistogram) and can run in a worker thread, commit takes its
+        result on the main thread, keeps it in the caches and returns the
+        histogram like getHistogram.
+        """
+        key = self.getResampleKey() + (targetHistogramSize,)
+        hist = self.hist_cache.get(key)
+        res_key = self.getCacheKey()
+        if hist is None:
+            [res_key, source] = self.getResampledSource()
+            hist_bins = np.linspace(
+                self.getMin(), self.getMax(), targetHistogramSize)
+
+        def compute():
+            if hist is not None:
+                return [None, hist]
+            volume = source()
+            [counts, nonzero] = computeHistogram(volume, hist_bins)
+            return [volume, (counts, hist_bins, nonzero)]
+
+        def commit(result):
+            [volume, found] = result
+            # nothing is kept if the image changed in the meantime
+            if res_key == self.getCacheKey():
+                self.putResampled(res_key, volume)
+                self.hist_cache[key] = found
+                self.hist = found
+            return found[1][:-1], found[0]
+
+        return [compute, commit]
+
+    def getNonzeroCount(self):
+        """
+        Returns the number of nonzero voxels of the resampled volume, which
+        is counted with the histogram.
         """
-        if self.hist_saved is not True:
-            xmin = self.getMin()
-            xmax = self.getMax()
-            hist_bins = np.linspace(xmin, xmax, targetHistogramSize)
-            self.hist = np.histogram(self.image_res[self.image_res!=0], bins=hist_bins)
-            self.hist_saved = True
-        return self.hist[1][:-1], self.hist[0]
+        self.getHistogram()
+        return self.hist[2]
 
     def getYRangeApprox(self):
         """
         Returns a y range for the current histogram that scales the plot
         reasonably.
         """
-        if self.hist_saved is not True:
-            self.getHistogram()
+        self.getHistogram()
         valid_bins = np.logical_and(
             self.hist[1][:-1] > self.threshold_pos[0],
             self.hist[1][:-1] < self.threshold_pos[1])
@@ -561,54 +912,92 @@ class Image(object):
         Return the coordinate of the local maximum within a cube of given width.
         """
         if (radius == 0):
-            return list(np.unravel_index(
-                self.image_res.argmax(), self.image_res.shape))
-        else:
-            shapes = self.image_res.shape
-            x_range = range(max(0, self.coord[0]-radius),
-                            min(self.coord[0]+radius, shapes[0]))
-            y_range = range(max(0, self.coord[1]-radius),
-                            min(self.coord[1]+radius, shapes[1]))
-            z_range = range(max(0, self.coord[2]-radius),
-                            min(self.coord[2]+radius, shapes[2]))
-            new_shape = [x_range[-1]-x_range[0]+1,
-                         y_range[-1]-y_range[0]+1,
-                         z_range[-1]-z_range[0]+1]
-            arg_max = \
-                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range]\
-                .argmax()
-            arg_coord = list(np.unravel_index(arg_max, new_shape))
-            arg_coord[0] += x_range[0]
-            arg_coord[1] += y_range[0]
-            arg_coord[2] += z_range[0]
-            return arg_coord
+            return self.getExtremumCoord(True)
+        return searchCube(
+            self.getResampledData(), self.coord, radius, maxima=True)
 
     def getMinCoord(self, radius=0):
         """
         Return the coordinate of the local minimum within a cube of given width.
         """
         if (radius == 0):
-            return list(np.unravel_index(
-                self.image_res.argmin(), self.image_res.shape))
+            return self.getExtremumCoord(False)
+        return searchCube(
+            self.getResampledData(), self.coord, radius, maxima=False)
+
+    def getExtremumCoord(self, maxima=True):
+        """
+        Returns the coordinate of the maximum (or minimum) of the resampled
+        volume, computed once per frame and resampling.
+        """
+        key = self.getResampleKey() + ('extremum', maxima)
+        coord = self.peak_cache.get(key)
+        if coord is None:
+            coord = findExtremum(self.getResampledData(), maxima)
+            self.peak_cache[key] = coord
+        return list(coord)
+
+    def getPeaks(self, maxima=True):
+        """
+        Returns the coordinates of the local maxima (or minima) of the
+        resampled volume as (n, 3) array, the strongest first. They are
+        computed once per frame and resampling.
+        """
+        key = self.getResampleKey() + ('peaks', maxima)
+        peaks = self.peak_cache.get(key)
+        if peaks is None:
+            peaks = findPeaks(self.getResampledData(), maxima)
+            self.peak_cache[key] = peaks
+        return peaks
+
+    def getClusters(self, maxima=True):
+        """
+        Returns the clusters of the resampled volume above the lower positive
+        threshold (or below the upper negative threshold), see
+        ClusterTree.getClusters.
+        """
+        [compute, commit] = self.getClustersTask(maxima)
+        return commit(compute())
+
+    def getClustersTask(self, maxima=True):
+        """
+        Returns two functions: compute returns the clusters (see
+        getClusters) and can run in a worker thread, commit takes its result
+        on the main thread, keeps it in the caches and returns the clusters.
+
+        The tree is built once per frame and resampling and only built again
+        for a more lenient threshold.
+        """
+        if maxima:
+            threshold = float(self.threshold_pos[0])
         else:
-            shapes = self.image_res.shape
-            x_range = range(max(0, self.coord[0]-radius),
-                            min(self.coord[0]+radius, shapes[0]))
-            y_range = range(max(0, self.coord[1]-radius),
-                            min(self.coord[1]+radius, shapes[1]))
-            z_range = range(max(0, self.coord[2]-radius),
-                            min(self.coord[2]+radius, shapes[2]))
-            new_shape =  [x_range[-1]-x_range[0]+1,
-                          y_range[-1]-y_range[0]+1,
-                          z_range[-1]-z_range[0]+1]
-            arg_max = \
-                self.image_res[x_range,:,:][:,y_range,:][:,:,z_range]\
-                .argmin()
-            arg_coord = list(np.unravel_index(arg_max, new_shape))
-            arg_coord[0] += x_range[0]
-            arg_coord[1] += y_range[0]
-            arg_coord[2] += z_range[0]
-            return arg_coord
+            threshold = float(self.threshold_neg[1])
+        tree_key = self.getResampleKey() + ('clusters', maxima)
+        key = tree_key + (threshold,)
+        clusters = self.peak_cache.get(key)
+        tree = self.peak_cache.get(tree_key)
+        [res_key, source] = self.getResampledSource()
+
+        def compute():
+            if clusters is not None:
+                return [None, None, clusters]
+            if tree is not None and tree.covers(threshold):
+                return [None, None, tree.getClusters(threshold)]
+            volume = source()
+            new_tree = ClusterTree(volume, threshold, maxima)
+            return [volume, new_tree, new_tree.getClusters(threshold)]
+
+        def commit(result):
+            [volume, new_tree, found] = result
+            # nothing is kept if the image changed in the meantime
+            if res_key == self.getCacheKey():
+                self.putResampled(res_key, volume)
+                if new_tree is not None:
+                    self.peak_cache[tree_key] = new_tree
+                self.peak_cache[key] = found
+            return found
+
+        return [compute, commit]
 
     def openDialog(self):
         """
@@ -1,6 +1,7 @@
 from .pyqtgraph_vini import *
 
 from .Image import Image
+from .imageStats import computeExtremum
 from .ColorMapWidget import *
 # try:
 #     from pyvista import pyvista
@@ -22,7 +23,9 @@ class Image3D(Image):
         if 'filename' in kwargs:
             self.loadImageFromFile(kwargs['filename'])
         if 'image' in kwargs:
-            self.loadImageFromObject(kwargs['image'], kwargs['color'])
+            self.loadImageFromObject(
+                kwargs['image'], kwargs['color'], kwargs.get('data'),
+                kwargs.get('extremum'))
 
     def type(self):
         """
@@ -36,14 +39,19 @@ class Image3D(Image):
     def type_d(self):
         return "3D"
 
-    def loadImageFromObject(self, img, color=False):
+    def loadImageFromObject(self, img, color=False, data=None,
+                            extremum=None):
 
         self.image = img
+        # The data array and its extremum can be passed if the loader
+        # already has them.
+        self.image_data = data
 
-        self.image_res = img.get_data()
+        self.setResampled(self.getData())
 
-        self.extremum[0] = img.get_data().min()
-        self.extremum[1] = img.get_data().max()
+        if extremum is None:
+            extremum = computeExtremum(self.image_res)
+        self.extremum = extremum
 
         self.two_cm = color
         self.dialog.setPreferences(
@@ -13,7 +13,11 @@ from .pyqtgraph_vini import *
 from .FunctionalDialog import *
 from .AveragePlot import *
 from .Image import Image
-from .resample import resample_image
+from .SliceColorizer import SliceColorizer
+from .resample import resample_plane
+from .pyqtgraph_vini.util.lru_cache import LRUCache
+from .timeMajor import loadTimeMajor, buildTimeMajor
+from .imageStats import computeExtremum
 from .TimePlot import TimePlot
 from .testInputs import testFloat, testInteger
 # try:
@@ -38,6 +42,16 @@ class Image4D(Image):
         self.frame_time = 1
         self.image_slice_res = [None, None, None]
 
+        # Time-major copy of the data for time courses and the file it is
+        # made for (None after it was loaded or built).
+        self.time_major = None
+        self.time_major_source = None
+
+        # Colored slices of frames for playback, keyed by getFrameKey.
+        self.frame_cache = LRUCache(maxSize=64, resizeTo=32)
+        # frame: frame key of the pending prefetch task of the frame
+        self.prefetching = {}
+
         # while playing don't use the fully resampled image for slices
         # This might not be needed  anymore
         self.playing = False
@@ -56,7 +70,9 @@ class Image4D(Image):
         if 'filename' in kwargs:
             self.loadImageFromFile(kwargs['filename'])
         if 'image' in kwargs:
-            self.loadImageFromObject(kwargs['image'], kwargs['color'])
+            self.loadImageFromObject(
+                kwargs['image'], kwargs['color'], kwargs.get('data'),
+                kwargs.get('extremum'))
 
     def type(self):
         """
@@ -70,15 +86,21 @@ class Image4D(Image):
     def type_d(self):
         return "4D"
 
-    def loadImageFromObject(self, img, color=False):
+    def loadImageFromObject(self, img, color=False, data=None,
+                            extremum=None):
 
         self.image = img
+        # The data array and its extremum can be passed if the loader
+        # already has them.
+        self.image_data = data
 
-        self.image_res = img.get_data()[:,:,:,self.frame]
-        self.time_dim = img.get_data().shape[3] # set beginning from zero.
+        self.setResampled(self.getFrameData())
+        self.time_dim = img.shape[3] # set beginning from zero.
 
-        self.extremum[0] = img.get_data().min()
-        self.extremum[1] = img.get_data().max()
+        if extremum is None:
+            # one frame at a time, each is contiguous in the file
+            extremum = computeExtremum(self.getData(), slab=1)
+        self.extremum = extremum
 
         self.two_cm = color
         self.dialog.setPreferences(two_cm=self.two_cm, clippings_pos=self.clippings_pos, clippings_neg=self.clippings_neg)
@@ -92,20 +114,13 @@ class Image4D(Image):
         Returns the intensity at the current coordinate.
         """
         if self.playing == False:
-            if coord is not None:
-                coord = map(lambda x: int(x),coord)
-                return self.image_res[coord[0],coord[1],coord[2]]
-            else:
-                return self.image_res[self.coord[0],self.coord[1],self.coord[2]]
+            return super(Image4D, self).getIntensity(coord)
         else:
             # while in play mode no intensity values are displayed
             return np.nan
 
     def getOriginalDimensions(self):
-        return self.image.get_data().shape[0:3]
-
-    def getDimensions(self):
-        return self.image_res.shape[0:3]
+        return self.image.shape[0:3]
 
     def getTimeDim(self):
         return self.time_dim
@@ -114,10 +129,19 @@ class Image4D(Image):
         """ Return index of time beginning from zero. """
         return self.frame
 
+    def getFrameData(self, frame=None):
+        """
+        Returns the volume of the given (default: current) frame.
+
+        For memory-mapped data only this frame is read from the file.
+        """
+        if frame is None:
+            frame = self.frame
+        return self.getData()[:,:,:,frame]
+
     def setFrame(self, new_frame=0):
         if new_frame >= 0 and new_frame < self.time_dim:
             self.frame = new_frame
-            self.hist_saved = False
 
     def getBounds(self):
         adim, bdim, cdim = self.image.shape[0:3]
@@ -136,149 +160,118 @@ class Image4D(Image):
         box = np.dot(self.image.affine, box)[:3]
         return list(zip(box.min(axis=-1), box.max(axis=-1)))
 
-    def resample_overaffine(self, shape, t_affine, over_affine):
+    def resample_frame(self):
         """
-        Resamples the image to 'shape' with the transformation 'affine'
-        overwriting its own transformation with 'over_affine'.
+        Resamples the current frame with the already known affine.
         """
-        self.affine_res_inv = np.dot(np.linalg.inv(over_affine), t_affine)
-        self.res_shape = shape
-        self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=shape,
-            interpolation=self.interp_type)
-        self.state_affine_over = True
+        self.reresample()
 
-    def resample(self, shape, affine):
+    def resample_slice(self, shape, affine):
         """
-        Resamples the image to 'shape' with the transformation 'affine'.
+        Resamples only current slices.
         """
-        t_affine = np.dot(np.linalg.inv(self.image.affine), affine)
+        if not self.state_affine_over:
+            affine = np.dot(np.linalg.inv(self.image.affine), affine)
+            if not np.array_equal(affine, self.affine_res_inv):
+                self.affine_res_inv = affine
+                self.res_version += 1
         self.res_shape = shape
-        self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine,
-            shape=shape, interpolation=self.interp_type)
-        self.affine_res_inv = np.dot(np.linalg.inv(self.image.affine), affine)
-        self.state_affine_over = False
-
-    def reresample(self):
+        # The resampled volume belongs to another frame now.
+        self.image_res = None
+        self.image_quant = None
+
+        key = self.getFrameKey(self.frame)
+        cached = self.frame_cache.get(key)
+        if cached is not None:
+            [slices, self.xhairval] = cached
+            for i in range(3):
+                self.image_slices[i] = slices[i]
+                self.image_levels[i] = self.slice_levels[i]
+                self.slice_keys[i] = self.getSliceKey(i)
+                self.slice_versions[i] += 1
+            return
+
+        self.xhairval = \
+            self.getSlice(0, self.coord[0])[self.coord[1], self.coord[2]]
+
+        self.colorSlices()
+        self.frame_cache[key] = \
+            [[sl.copy(order='K') for sl in self.image_slices], self.xhairval]
+
+    def setFrameCacheSize(self, size):
         """
-        Resample frame with already known affine.
+        Sets the number of frames kept in the frame cache.
         """
-        self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=self.res_shape,
-            interpolation=self.interp_type)
+        size = max(int(size), 2)
+        self.frame_cache = LRUCache(maxSize=size, resizeTo=size//2)
 
-    def resample_frame(self):
+    def getFrameKey(self, frame):
         """
-        Same as reresample???
+        Returns what the colored slices of a frame depend on.
         """
-        self.image_res = resample_image(
-            self.image.get_data()[:,:,:,self.frame],
-            affine=self.affine_res_inv, shape=self.res_shape,
-            interpolation=self.interp_type)
+        return (frame, tuple(int(c) for c in self.coord), self.interp_type,
+                self.affine_res_inv.tobytes(),
+                tuple(np.asarray(self.res_shape).astype(int)),
+                self.lut_version, tuple(self.getColorParams()[1::2]),
+                tuple(self.slice_levels))
 
-    def resample_slice(self, shape, affine):
+    def prefetchFrames(self, frames):
         """
-        Resamples only current slices.
+        Colors the slices of the given frames in the background and puts
+        them into the frame cache.
         """
-        
-        t_affine = np.dot(np.linalg.inv(self.image.affine), affine)
-        if self.state_affine_over:
-            # TODO: use this as default without if-clause?
-            # doesn't hurt to leave this here
-            t_affine = self.affine_res_inv
-
-        n_coord = np.dot(t_affine[0:3,0:3], self.coord)
-        n_coord = np.zeros((3,1))
-        n_coord[0] = self.coord[0]
-        shift = np.dot(t_affine[0:3,0:3], n_coord)
-        t_affine_0 = np.copy(t_affine)
-        t_affine_0[0:3][:,3:4] = np.add(t_affine_0[0:3][:,3:4], shift)
-        shape_0 = np.copy(shape)
-        shape_0[0] = 1
-        self.image_slice_res_sa = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_0,
-            shape=shape_0, interpolation=self.interp_type)[0,:,:]
-        
-        self.xhairval = self.image_slice_res_sa[self.coord[1], self.coord[2]]
-        
-        n_coord = np.zeros((3,1))
-        n_coord[1] = self.coord[1]
-        shift = np.dot(t_affine[0:3,0:3], n_coord)
-        t_affine_1 = np.copy(t_affine)
-        t_affine_1[0:3][:,3:4] = np.add(t_affine_1[0:3][:,3:4], shift)
-        shape_1 = np.copy(shape)
-        shape_1[1] = 1
-        
-       
-        
-        self.image_slice_res_co = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_1,
-            shape=shape_1, interpolation=self.interp_type)[:,0,:]
-        n_coord = np.zeros((3,1))
-        n_coord[2] = self.coord[2]
-        shift = np.dot(t_affine[0:3,0:3], n_coord)
-        t_affine_2 = np.copy(t_affine)
-        t_affine_2[0:3][:,3:4] = np.add(t_affine_2[0:3][:,3:4], shift)
-        shape_2 = np.copy(shape)
-        shape_2[2] = 1
-        self.image_slice_res_tr = resample_image(
-            self.image.get_data()[:,:,:,self.frame], affine=t_affine_2,
-            shape=shape_2, interpolation=self.interp_type)[:,:,0]
-
-        [self.image_slices_pos[0], truth] = \
-            makeARGB(
-                self.image_slice_res_sa, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            makeARGB(
-                self.image_slice_res_co, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            makeARGB(
-                self.image_slice_res_tr, lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
+        if self.scheduler is None or self.affine_res_inv is None:
+            return
+        coord = [int(c) for c in self.coord]
+        params = self.getColorParams()
+        for frame in frames:
+            key = self.getFrameKey(frame)
+            if self.frame_cache.get(key) is not None:
+                continue
+            # One task per frame: a request for another crosshair position
+            # or other thresholds replaces the older one.
+            task = (self, 'prefetch', frame)
+            if (self.scheduler.isPending(task) and
+                    self.prefetching.get(frame) == key):
+                continue
+            self.prefetching[frame] = key
+            self.scheduler.submit(
+                task, self.renderFrame,
+                (frame, np.copy(self.affine_res_inv), self.res_shape, coord,
+                 list(self.slice_levels), params),
+                callback=lambda result, key=key: self.cacheFrame(key, result))
+
+    def renderFrame(self, frame, affine, shape, coord, levels, params):
+        """
+        Returns the colored slices and the crosshair value of a frame.
 
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                makeARGB(
-                    self.image_slice_res_sa, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                makeARGB(
-                    self.image_slice_res_co, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                makeARGB(
-                    self.image_slice_res_tr, self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = self.image_slices_pos[2] + self.image_slices_neg[2]
+        Runs in a worker thread, so it only uses its arguments.
+        """
+        data = self.getFrameData(frame)
+        planes = [resample_plane(data, affine, shape, i, coord[i],
+                                 self.interp_type, step=2**levels[i])
+                  for i in range(3)]
+        [lut_pos, levels_pos, lut_neg, levels_neg] = params
+        # own colorizer, the tables of a shared one would not be thread-safe
+        colorizer = SliceColorizer(bgra=True)
+        slices = [colorizer.colorize(
+            pl, lut_pos, levels_pos, lut_neg, levels_neg) for pl in planes]
+        if levels[0] == 0:
+            xhairval = planes[0][coord[1], coord[2]]
         else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
-            
-        
+            xhairval = resample_plane(
+                data, affine, shape, 0, coord[0], self.interp_type)[
+                    coord[1], coord[2]]
+        return [slices, xhairval]
+
+    def cacheFrame(self, key, result):
+        self.frame_cache[key] = result
 
     def setPlaying(self, state):
         self.playing = state
 
     def slice(self, coord=None):
-        if self.image_res is None:
+        if self.image_res is None and self.affine_res_inv is None:
             return 0
         if coord is not None:
             self.coord = coord
@@ -288,52 +281,7 @@ class Image4D(Image):
         self.updateTimeData()
         self.updateTimeAverageData()
 
-        [self.image_slices_pos[0], truth] = \
-            makeARGB(
-                self.image_res[self.coord[0],:,:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[1], truth] = \
-            makeARGB(
-                self.image_res[:,self.coord[1],:], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-        [self.image_slices_pos[2], truth] = \
-            makeARGB(
-                self.image_res[:,:,self.coord[2]], lut=self.cmap_pos,
-                levels=[self.threshold_pos[0], self.threshold_pos[1]],
-                useRGBA=True)
-
-        if self.two_cm:
-            [self.image_slices_neg[0], truth] = \
-                makeARGB(
-                    self.image_res[self.coord[0],:,:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[1], truth] = \
-                makeARGB(
-                    self.image_res[:,self.coord[1],:], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-            [self.image_slices_neg[2], truth] = \
-                makeARGB(
-                    self.image_res[:,:,self.coord[2]], self.cmap_neg,
-                    levels=[self.threshold_neg[0], self.threshold_neg[1]],
-                    useRGBA=True)
-
-        # add positive and negative parts
-        if (self.two_cm and
-                float(self.threshold_neg[0]) != float(self.threshold_neg[1])):
-            self.image_slices[0] = \
-                self.image_slices_pos[0] + self.image_slices_neg[0]
-            self.image_slices[1] = \
-                self.image_slices_pos[1] + self.image_slices_neg[1]
-            self.image_slices[2] = \
-                self.image_slices_pos[2] + self.image_slices_neg[2]
-        else:
-            self.image_slices[0] = self.image_slices_pos[0]
-            self.image_slices[1] = self.image_slices_pos[1]
-            self.image_slices[2] = self.image_slices_pos[2]
+        self.colorSlices()
 
     def setTime(self, time):
         self.frame_time = 1 #time #TR =1 forever...
@@ -395,24 +343,91 @@ class Image4D(Image):
             self.timeseries.delDesign()
             self.design = None
 
+    def getTimeCourse(self, coords):
+        """
+        Returns the time course of the voxel with the original voxel
+        coordinates 'coords'. With an array of n coordinates (n x 3) an
+        n x time_dim array of all time courses is returned.
+        """
+        if self.time_major is not None:
+            data = self.time_major
+        else:
+            data = self.getData()
+        coords = np.asarray(coords, dtype=np.intp)
+        if coords.ndim == 1:
+            return np.array(data[coords[0],coords[1],coords[2],:])
+        return np.array(data[coords[:,0],coords[:,1],coords[:,2],:])
+
+    def setTimeMajorSource(self, filename):
+        """
+        Reads time courses from a time-major copy of the data next to the
+        file. It is loaded or built when time courses are needed first.
+        """
+        self.time_major_source = filename
+
+    def prepareTimeMajor(self):
+        """
+        Loads the time-major copy of the data or starts building it (in the
+        background if there is a scheduler).
+        """
+        if self.time_major_source is None:
+            return
+        filename = self.time_major_source
+        # only try once, also if the file cannot be written
+        self.time_major_source = None
+        data = self.getData()
+        self.time_major = loadTimeMajor(filename, data.shape, data.dtype)
+        if self.time_major is not None:
+            return
+        if self.scheduler is not None:
+            self.scheduler.submit(
+                (self, 'time_major'), buildTimeMajor, (data, filename),
+                callback=self.setTimeMajor)
+        else:
+            try:
+                self.setTimeMajor(buildTimeMajor(data, filename))
+            except (OSError, IOError) as e:
+                print("Cannot write time-major copy: {}".format(e))
+
+    def setTimeMajor(self, data):
+        self.time_major = data
+
+    def getMappedVoxel(self):
+        """
+        Returns the original voxel coordinates of the current coordinates or
+        None if they are outside of the data.
+        """
+        xyz = np.array([self.coord[0], self.coord[1], self.coord[2], 1])
+        map_xyz = np.dot(self.affine_res_inv, xyz).astype(np.int32)
+        shp = self.image.shape
+        # TODO: make this a shorter comparison
+        if (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
+                map_xyz[1] >= 0 and map_xyz[1] < shp[1] and
+                map_xyz[2] >= 0 and map_xyz[2] < shp[2]):
+            return map_xyz[0:3]
+        return None
+
     def updateTimeData(self):
         """
         Updates the time plot when the coordinate is changed.
+
+        With a scheduler the time course is read in the background.
         """
         if self.affine_res_inv is not None and self.timeseries is not None:
-            xyz = np.array([self.coord[0], self.coord[1], self.coord[2], 1])
-            map_xyz = np.dot(self.affine_res_inv, xyz).astype(np.int32)
-            shp = self.image.get_data().shape
-            # TODO: make this a shorter comparison
-            if (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
-                    map_xyz[1] >= 0 and map_xyz[1] < shp[1] and
-                    map_xyz[2] >= 0 and map_xyz[2] < shp[2]):
-                self.timeseries.setData(
-                    self.image.get_data()[map_xyz[0],map_xyz[1],map_xyz[2],:],
-                    self.frame_time)
+            self.prepareTimeMajor()
+            map_xyz = self.getMappedVoxel()
+            if map_xyz is None:
+                self.setTimeData(np.zeros((self.time_dim)))
+            elif self.scheduler is not None:
+                self.scheduler.submit(
+                    (self, 'timeseries'), self.getTimeCourse, (map_xyz,),
+                    callback=self.setTimeData)
             else:
-                self.timeseries.setData(
-                    np.zeros((self.time_dim)),self.frame_time)
+                self.setTimeData(self.getTimeCourse(map_xyz))
+
+    def setTimeData(self, time_course):
+        if self.timeseries is not None:
+            self.timeseries.setData(time_course, self.frame_time)
 
     def openFuncDialog(self):
         """
@@ -442,8 +457,8 @@ class Image4D(Image):
         """
         if self.design is not None:
             # for every experimental condition:
-            self.num_pts = np.floor(
-                self.funcdialog.cond_time/self.funcdialog.cond_dx)
+            self.num_pts = int(np.floor(
+                self.funcdialog.cond_time/self.funcdialog.cond_dx))
             self.time_pts_cond = np.linspace(
                 0, self.num_pts*self.funcdialog.cond_dx, self.num_pts)
             self.time_pts = np.linspace(
@@ -467,8 +482,17 @@ class Image4D(Image):
                         # append timepoints for this interval
                         self.x_pos[cond].append(self.time_pts_cond+interval[1])
 
+            # Interpolation plan: indices and weights of the time points of
+            # all trials, one array (num_pts x trials) each per condition.
+            self.ta_plan = [
+                interpolationPlan(
+                    np.reshape(self.x_pos[cond],
+                               (len(self.x_pos[cond]), self.num_pts)).T,
+                    self.time_pts)
+                for cond in range(self.num_cond)]
+
             if self.time_averages is None:
-                self.time_averages = AveragePlot.AveragePlot()
+                self.time_averages = AveragePlot()
             # initialize plots & colors
             self.time_averages.reset()
             self.updateTimeAverageData()
@@ -480,38 +504,76 @@ class Image4D(Image):
     def updateTimeAverageData(self):
         """
         Updates the time average data if the coordinate is changed.
+
+        With a scheduler the averages are computed in the background.
         """
         if self.affine_res_inv is not None and self.time_averages is not None:
             # set factor for stddev
             self.time_averages.setCStddev(self.funcdialog.cond_stddevs)
+            self.prepareTimeMajor()
             # compute original data voxel
-            xyz = np.array([self.coord[0], self.coord[1], self.coord[2], 1])
-            map_xyz = np.dot(self.affine_res_inv, xyz)
-            shp = self.image.get_data().shape
+            map_xyz = self.getMappedVoxel()
             # if voxel is in the data
-            # TODO: make this a nicer comparison
-            if (map_xyz[0] >= 0 and map_xyz[0] < shp[0] and
-                    map_xyz[1] >= 0 and map_xyz[1] < shp[1] and
-                    map_xyz[2] >= 0 and map_xyz[2] < shp[2]):
-                # retrieve voxel data
-                voxel_data = \
-                    self.image.get_data()[map_xyz[0],map_xyz[1],map_xyz[2],:]
-                # for every condition compute average over trials
-                for cond in range(self.num_cond):
-                    data = np.zeros((self.num_pts, len(self.x_pos[cond])))
-                    for trial in range(len(self.x_pos[cond])):
-                        data[:,trial] = np.interp(
-                            self.x_pos[cond][trial], self.time_pts, voxel_data)
-                    mean = data.mean(axis=1)
-                    stderr = np.std(data, axis=1)/len(self.x_pos[cond])
-                    # self.cond_conds[cond] is the actual condition number
-                    self.time_averages.updateData(
-                        self.cond_conds[cond], self.time_pts_cond, mean,
-                        stderr, self.cond_colors[self.cond_conds[cond]])
+            if map_xyz is None:
+                self.setTimeAverageData(None)
+            elif self.scheduler is not None:
+                self.scheduler.submit(
+                    (self, 'time_averages'), self.computeTimeAverages,
+                    (map_xyz,), callback=self.setTimeAverageData)
             else:
-                # flat line all lines
-                zeros = np.zeros((self.time_pts_cond.shape))
-                for cond in range(self.num_cond):
-                    self.time_averages.updateData(
-                        self.cond_conds[cond], self.time_pts_cond, zeros,
-                        zeros, self.cond_colors[self.cond_conds[cond]])
+                self.setTimeAverageData(self.computeTimeAverages(map_xyz))
+
+    def computeTimeAverages(self, map_xyz):
+        """
+        Computes mean and standard error over the trials of every condition
+        for the voxel 'map_xyz'. With an array of voxels (n x 3) the averages
+        of their mean time course are computed.
+        """
+        # retrieve voxel data
+        voxel_data = self.getTimeCourse(map_xyz)
+        if voxel_data.ndim > 1:
+            voxel_data = voxel_data.mean(axis=0)
+        averages = []
+        # for every condition compute average over trials
+        for cond in range(self.num_cond):
+            [lo, hi, weight] = self.ta_plan[cond]
+            # like np.interp for every trial (columns)
+            data = voxel_data[lo]*(1-weight) + voxel_data[hi]*weight
+            mean = data.mean(axis=1)
+            stderr = np.std(data, axis=1)/len(self.x_pos[cond])
+            averages.append([mean, stderr])
+        return averages
+
+    def setTimeAverageData(self, averages):
+        """
+        Updates the plots with the averages of computeTimeAverages. None
+        flat lines all plots.
+        """
+        if self.time_averages is None:
+            return
+        zeros = np.zeros((self.time_pts_cond.shape))
+        for cond in range(self.num_cond):
+            if averages is None:
+                [mean, stderr] = [zeros, zeros]
+            else:
+                [mean, stderr] = averages[cond]
+            # self.cond_conds[cond] is the actual condition number
+            self.time_averages.updateData(
+                self.cond_conds[cond], self.time_pts_cond, mean,
+                stderr, self.cond_colors[self.cond_conds[cond]])
+
+
+def interpolationPlan(x, xp):
+    """
+    Returns indices lo, hi and weights w (all shaped like x) so that
+    fp[lo]*(1-w) + fp[hi]*w is np.interp(x, xp, fp) for any fp, i.e. x is
+    clamped to the range of the increasing xp.
+    """
+    x = np.clip(x, xp[0], xp[-1])
+    if len(xp) == 1:
+        zeros = np.zeros(x.shape, dtype=np.intp)
+        return [zeros, zeros, np.zeros(x.shape)]
+    hi = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp)-1)
+    lo = hi - 1
+    weight = (x - xp[lo])/(xp[hi] - xp[lo])
+    return [lo, hi, weight]
@@ -8,6 +8,8 @@ from .pyqtgraph_vini import functions as fn
 from .pyqtgraph_vini import Point
 from .pyqtgraph_vini import ItemGroup
 
+from .SliceImageStore import SliceImageStore
+
 
 class ImageItemMod(ImageItem):
     """
@@ -16,6 +18,9 @@ class ImageItemMod(ImageItem):
 
     sigMouseDrag = QtCore.Signal(object)
 
+    # rendered slices shared by all items
+    image_store = SliceImageStore()
+
     def __init__(self, image=None, **kargs):
         super(ImageItemMod, self).__init__()
         """
@@ -23,6 +28,76 @@ class ImageItemMod(ImageItem):
         """
         GraphicsObject.__init__(self)
 
+        # version of the displayed slice, see setSlice, and its rendered
+        # image from the store
+        self.slice_version = None
+        self.shared_image = None
+        # whether the image is a BGRA slice that is only wrapped in a QImage
+        self.prerendered = False
+        # pyramid level of the displayed slice
+        self.pyramid_level = 0
+
+    def setSlice(self, image, version, level=0):
+        """
+        Sets the image unless the slice with this version is displayed
+        already.
+
+        Slices are colored already: image is a BGRA array (see
+        SliceColorizer) whose rows are contiguous, which is wrapped into a
+        QImage without copying, levels or lookup tables.
+
+        A slice of pyramid level l has every 2**l-th voxel and is scaled up
+        to the size of the full slice.
+        """
+        if version is not None and version == self.slice_version:
+            return
+        self.setPyramidLevel(level)
+        self.setImage(image, autoLevels=False)
+        self.slice_version = version
+        self.prerendered = True
+
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        # Other images than slices are rendered by the item itself.
+        if image is not None:
+            self.slice_version = None
+            self.shared_image = None
+            self.prerendered = False
+        super(ImageItemMod, self).setImage(image, autoLevels, **kargs)
+
+    def render(self):
+        """
+        Renders the image or takes the rendered slice from the store if
+        another item displays the same slice.
+        """
+        if not self.prerendered:
+            return super(ImageItemMod, self).render()
+        if self.slice_version is None:
+            self.renderImage()
+            return
+        self.shared_image = self.image_store.get(
+            self.slice_version, self.renderImage)
+        if self.shared_image is not None:
+            self.qimage = self.shared_image.qimage
+
+    def renderImage(self):
+        """
+        Wraps the BGRA slice into a QImage.
+        """
+        if self.image is None or self.image.size == 0:
+            return None
+        # (width, height) to the (height, width) order of QImage
+        data = self.image.transpose((1, 0, 2))
+        if not data.flags['C_CONTIGUOUS']:
+            data = np.ascontiguousarray(data)
+        self.qimage = fn.makeQImage(
+            data, alpha=True, copy=False, transpose=False)
+        return self.qimage
+
+    def setPyramidLevel(self, level):
+        if level != self.pyramid_level:
+            self.pyramid_level = level
+            self.setTransform(QtGui.QTransform.fromScale(2**level, 2**level))
+
     def mouseDragEvent(self, ev):
         ev.accept()
 
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import threading
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResampleCache(object):
+    """
+    Keeps resampled volumes so that images whose resampling didn't change
+    are not resampled again, e.g. when another image is loaded or when going
+    back to a frame.
+
+    Volumes are keyed by image and resampling (see Image.getCacheKey) and
+    kept in memory up to a number of bytes. With a disk budget, volumes that
+    don't fit into memory anymore are written to a temporary directory and
+    memory-mapped when they are needed again. The least recently used volumes
+    are dropped first.
+    """
+
+    def __init__(self, max_bytes, max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        # key: volume, in order of use
+        self.volumes = OrderedDict()
+        self.nbytes = 0
+        # key: (path, nbytes), in order of use
+        self.spilled = OrderedDict()
+        self.disk_bytes = 0
+        self.spill_dir = None
+        self.file_ids = itertools.count()
+        # volumes are also requested in worker threads (e.g. histograms)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the volume for key or None.
+        """
+        with self.lock:
+            volume = self.volumes.pop(key, None)
+            if volume is not None:
+                self.volumes[key] = volume
+                return volume
+            entry = self.spilled.pop(key, None)
+            if entry is None:
+                return None
+            self.spilled[key] = entry
+            # copy-on-write, the file stays as it is
+            return np.load(entry[0], mmap_mode='c')
+
+    def put(self, key, volume):
+        """
+        Stores the volume for key.
+        """
+        if volume is None or volume.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.volumes.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.volumes[key] = volume
+            self.nbytes += volume.nbytes
+            while self.nbytes > self.max_bytes:
+                [old_key, old] = self.volumes.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.spill(old_key, old)
+
+    def spill(self, key, volume):
+        """
+        Writes a volume dropped from memory to the disk store if it fits.
+        """
+        if (key in self.spilled or isinstance(volume, np.memmap) or
+                volume.nbytes > self.max_disk_bytes):
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='vini-resample-')
+        path = os.path.join(
+            self.spill_dir, '{}.npy'.format(next(self.file_ids)))
+        try:
+            np.save(path, volume)
+        except (OSError, IOError):
+            return
+        self.spilled[key] = (path, volume.nbytes)
+        self.disk_bytes += volume.nbytes
+        while self.disk_bytes > self.max_disk_bytes:
+            [old_key, [old_path, nbytes]] = self.spilled.popitem(last=False)
+            self.disk_bytes -= nbytes
+            os.remove(old_path)
+
+    def clear(self):
+        with self.lock:
+            self.volumes.clear()
+            self.nbytes = 0
+            for [path, nbytes] in self.spilled.values():
+                os.remove(path)
+            self.spilled.clear()
+            self.disk_bytes = 0
+
+    def close(self):
+        """
+        Clears the cache and removes the disk store.
+        """
+        self.clear()
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
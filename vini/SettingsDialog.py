@@ -31,6 +31,7 @@ class SettingsDialog(QtGui.QDialog):
         self.tab_view = QtGui.QWidget()
         self.tab_color = QtGui.QWidget()
         self.tab_resample = QtGui.QWidget()
+        self.tab_load = QtGui.QWidget()
         self.tab_search = QtGui.QWidget()
 
         # View Options
@@ -45,6 +46,18 @@ class SettingsDialog(QtGui.QDialog):
         self.savesize_button = QtGui.QPushButton("Start with current window size")
         self.savesize_button.clicked.connect(self.saveWindowSize)
         self.l_view.addRow("Save window size:", self.savesize_button)
+        self.frame_cache_sb = QtGui.QSpinBox()
+        self.frame_cache_sb.setRange(2, 1024)
+        self.l_view.addRow("Frames cached for playback:", self.frame_cache_sb)
+        self.prefetch_sb = QtGui.QSpinBox()
+        self.prefetch_sb.setRange(0, 64)
+        self.l_view.addRow("Frames prefetched while playing:", self.prefetch_sb)
+        self.pyramid_cb = QtGui.QCheckBox()
+        self.l_view.addRow(
+            "Downsample slices when zoomed out:", self.pyramid_cb)
+        self.composite_cb = QtGui.QCheckBox()
+        self.l_view.addRow(
+            "Composite overlays into one image:", self.composite_cb)
 
         # Color maps
         self.l_color = QtGui.QFormLayout()
@@ -77,6 +90,9 @@ class SettingsDialog(QtGui.QDialog):
             "Clip overlay higher neg. threshold:", self.clip_cb_over_high_neg)
         self.l_color.addRow(
             "Clip overlay lower neg. threshold:", self.clip_cb_over_low_neg)
+        self.quantize_cb = QtGui.QCheckBox()
+        self.l_color.addRow(
+            "Quantize images for fast thresholding:", self.quantize_cb)
 
         # Resampling defaults
         self.l_resample = QtGui.QFormLayout()
@@ -90,10 +106,46 @@ class SettingsDialog(QtGui.QDialog):
         self.method_box.addItem("resample to last loaded")
         self.method_box.addItem("resample to fit")
         self.l_resample.addRow("Resampling method:", self.method_box)
+        self.on_demand_cb = QtGui.QCheckBox()
+        self.l_resample.addRow(
+            "Resample displayed slices only:", self.on_demand_cb)
+        self.threads_sb = QtGui.QSpinBox()
+        self.threads_sb.setRange(0, 64)
+        self.threads_sb.setSpecialValueText("all cores")
+        self.l_resample.addRow("Resampling threads:", self.threads_sb)
+        self.res_cache_sb = QtGui.QSpinBox()
+        self.res_cache_sb.setRange(0, 1024*1024)
+        self.res_cache_sb.setSuffix(" MB")
+        self.l_resample.addRow(
+            "Memory for resampled volumes:", self.res_cache_sb)
+        self.res_disk_sb = QtGui.QSpinBox()
+        self.res_disk_sb.setRange(0, 1024*1024)
+        self.res_disk_sb.setSuffix(" MB")
+        self.l_resample.addRow(
+            "Disk space for resampled volumes:", self.res_disk_sb)
+
+        # Loading
+        self.l_load = QtGui.QFormLayout()
+        self.tab_load.setLayout(self.l_load)
+        self.lazy_cb = QtGui.QCheckBox()
+        self.l_load.addRow(
+            "Memory-map uncompressed files (load lazily):", self.lazy_cb)
+        self.time_major_cb = QtGui.QCheckBox()
+        self.l_load.addRow(
+            "Save time-major copies of 4D files for time courses:",
+            self.time_major_cb)
+        self.gz_cache_cb = QtGui.QCheckBox()
+        self.l_load.addRow(
+            "Cache uncompressed copies of .gz files:", self.gz_cache_cb)
+        self.gz_cache_sb = QtGui.QSpinBox()
+        self.gz_cache_sb.setRange(1, 1024*1024)
+        self.gz_cache_sb.setSuffix(" MB")
+        self.l_load.addRow("Size of the cache:", self.gz_cache_sb)
 
         self.qtab.addTab(self.tab_view, "Viewing options")
         self.qtab.addTab(self.tab_color, "Color maps")
         self.qtab.addTab(self.tab_resample, "Resampling")
+        self.qtab.addTab(self.tab_load, "Loading")
 
         # cancel button
         self.cancel_button = QtGui.QPushButton('Cancel', self)
@@ -120,6 +172,10 @@ class SettingsDialog(QtGui.QDialog):
         self.voxel_cb.setChecked(self.preferences['voxel_coord'])
         self.link_menu.setCurrentIndex(self.preferences['link_mode'])
         # window size...
+        self.frame_cache_sb.setValue(self.preferences['frame_cache'])
+        self.prefetch_sb.setValue(self.preferences['prefetch_frames'])
+        self.pyramid_cb.setChecked(self.preferences['slice_pyramid'])
+        self.composite_cb.setChecked(self.preferences['composite_slices'])
 
         # Color
         self.gradient_underlay.item.loadPreset(self.preferences['cm_under'])
@@ -136,10 +192,21 @@ class SettingsDialog(QtGui.QDialog):
             self.preferences['clip_neg_high'])
         self.clip_cb_over_low_neg.setChecked(
             self.preferences['clip_neg_low'])
+        self.quantize_cb.setChecked(self.preferences['quantize'])
 
         # Resampling
         self.interp_menu.setCurrentIndex(self.preferences['interpolation'])
         self.method_box.setCurrentIndex(self.preferences['res_method'])
+        self.on_demand_cb.setChecked(self.preferences['res_on_demand'])
+        self.threads_sb.setValue(self.preferences['res_threads'])
+        self.res_cache_sb.setValue(self.preferences['res_cache_size'])
+        self.res_disk_sb.setValue(self.preferences['res_cache_disk'])
+
+        # Loading
+        self.lazy_cb.setChecked(self.preferences['lazy_loading'])
+        self.time_major_cb.setChecked(self.preferences['time_major'])
+        self.gz_cache_cb.setChecked(self.preferences['gz_cache'])
+        self.gz_cache_sb.setValue(self.preferences['gz_cache_size'])
 
     def savePreferences(self):
         """
@@ -149,6 +216,10 @@ class SettingsDialog(QtGui.QDialog):
         self.preferences['voxel_coord'] = self.voxel_cb.isChecked()
         self.preferences['link_mode'] = self.link_menu.currentIndex()
         # window size has signal and is saved directly.
+        self.preferences['frame_cache'] = self.frame_cache_sb.value()
+        self.preferences['prefetch_frames'] = self.prefetch_sb.value()
+        self.preferences['slice_pyramid'] = self.pyramid_cb.isChecked()
+        self.preferences['composite_slices'] = self.composite_cb.isChecked()
 
         # Color
         self.preferences['cm_under'] = self.gradient_underlay.item.name
@@ -160,10 +231,21 @@ class SettingsDialog(QtGui.QDialog):
         self.preferences['clip_pos_low'] = self.clip_cb_over_low_pos.isChecked()
         self.preferences['clip_neg_high'] = self.clip_cb_over_high_neg.isChecked()
         self.preferences['clip_neg_low'] = self.clip_cb_over_low_neg.isChecked()
+        self.preferences['quantize'] = self.quantize_cb.isChecked()
 
         # Resampling
         self.preferences['interpolation'] = self.interp_menu.currentIndex()
         self.preferences['res_method'] = self.method_box.currentIndex()
+        self.preferences['res_on_demand'] = self.on_demand_cb.isChecked()
+        self.preferences['res_threads'] = self.threads_sb.value()
+        self.preferences['res_cache_size'] = self.res_cache_sb.value()
+        self.preferences['res_cache_disk'] = self.res_disk_sb.value()
+
+        # Loading
+        self.preferences['lazy_loading'] = self.lazy_cb.isChecked()
+        self.preferences['time_major'] = self.time_major_cb.isChecked()
+        self.preferences['gz_cache'] = self.gz_cache_cb.isChecked()
+        self.preferences['gz_cache_size'] = self.gz_cache_sb.value()
 
         self.sigSaveSettings.emit()
         self.close()
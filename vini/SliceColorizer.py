@@ -0,0 +1,182 @@
+import numpy as np
+
+
+class SliceColorizer(object):
+    """
+    Applies thresholds and color maps to slices of an image.
+
+    This does the same as calling mymakeARGB with the positive and the
+    negative color map and adding both results, but in one lookup in a
+    combined table and without temporary arrays: every plane has its own
+    buffers that are reused as long as the shape of the slice stays the same.
+
+    The colored slices are (x, y, channel) arrays whose rows (the y axis)
+    are contiguous like the lines of a QImage. With bgra the channels are
+    in the byte order of QImage.Format_ARGB32, so ImageItemMod can display
+    them without converting them again.
+    """
+
+    def __init__(self, bgra=False):
+        self.bgra = bgra
+        # buffers for each plane: {plane: dict of arrays}
+        self.buffers = {}
+        # color maps as uint8 tables and their combination, only recomputed
+        # when other color map arrays are given
+        self.lut_pos = None
+        self.lut_neg = None
+        self.table = None
+
+    def getBuffers(self, plane, shape, dtype):
+        """
+        Returns the buffers for the plane, allocating them if necessary.
+        Without a plane new buffers are returned.
+        """
+        bufs = self.buffers.get(plane)
+        if (bufs is None or bufs['rgba'].shape[0:2] != shape[::-1] or
+                bufs['scaled'].dtype != dtype):
+            bufs = {
+                # (y, x, channel), returned transposed
+                'rgba': np.empty(shape[::-1] + (4,), dtype=np.ubyte),
+                'scaled': np.empty(shape, dtype=dtype),
+                'mask': np.empty(shape, dtype=bool),
+                'index': np.empty(shape, dtype=np.intp),
+                'index_neg': np.empty(shape, dtype=np.intp)}
+            if plane is not None:
+                self.buffers[plane] = bufs
+        return bufs
+
+    def getTable(self, lut_pos, lut_neg):
+        """
+        Returns the lookup table for the indices computed in colorize.
+
+        With two color maps the entry i*len(lut_neg)+j is the sum of the
+        entries i and j of both color maps (as uint8, like adding the RGBA
+        arrays of both color maps).
+        """
+        if lut_pos is not self.lut_pos or lut_neg is not self.lut_neg:
+            self.lut_pos = lut_pos
+            self.lut_neg = lut_neg
+            table = toRGBA(lut_pos)
+            if lut_neg is not None:
+                table = (table[:,np.newaxis,:] +
+                         toRGBA(lut_neg)[np.newaxis,:,:]).reshape(-1, 4)
+            if self.bgra:
+                table = np.ascontiguousarray(table[:,[2,1,0,3]])
+            self.table = table
+        return self.table
+
+    def colorize(self, data, lut_pos, levels_pos, lut_neg=None,
+                 levels_neg=None, plane=None):
+        """
+        Returns the RGBA array of the 2D array data.
+
+        With a plane the returned array is the buffer of this plane and is
+        overwritten with the next call for the same plane.
+        """
+        data = np.asarray(data)
+        levels_pos = np.asarray(levels_pos, dtype=float)
+        # Same precision as the computation in myrescaleData.
+        dtype = np.result_type(data, levels_pos[0])
+        bufs = self.getBuffers(plane, data.shape, dtype)
+
+        table = self.getTable(lut_pos, lut_neg)
+        computeIndices(data, levels_pos, len(lut_pos), bufs['index'], bufs)
+        if lut_neg is not None:
+            levels_neg = np.asarray(levels_neg, dtype=float)
+            computeIndices(
+                data, levels_neg, len(lut_neg), bufs['index_neg'], bufs)
+            np.multiply(bufs['index'], len(lut_neg), out=bufs['index'])
+            np.add(bufs['index'], bufs['index_neg'], out=bufs['index'])
+        return self.take(table, bufs['index'], bufs)
+
+    def lookup(self, indices, table, plane=None):
+        """
+        Returns the RGBA array of the 2D array of indices into table, e.g.
+        a quantized slice and the table of getQuantizedTable.
+        """
+        bufs = self.getBuffers(plane, indices.shape, np.float64)
+        return self.take(table, indices, bufs)
+
+    def take(self, table, indices, bufs):
+        """
+        Looks up the indices in the table row by row of the image.
+        """
+        np.take(table, indices.T, axis=0, mode='clip', out=bufs['rgba'])
+        return bufs['rgba'].transpose((1, 0, 2))
+
+
+def toRGBA(lut):
+    """
+    Returns the color map as uint8 table with alpha channel.
+    """
+    lut = np.asarray(lut)
+    if lut.shape[1] == 3:
+        alpha = np.empty((lut.shape[0], 1))
+        alpha.fill(255)
+        lut = np.concatenate((lut, alpha), axis=1)
+    return lut.astype(np.ubyte)
+
+def quantizationGrid(vmin, vmax, n=65536):
+    """
+    Returns step and zero code of a grid of n values covering vmin...vmax
+    and 0. The value of code c is (c-zero)*step, so 0 is represented exactly
+    (resampled volumes are 0 outside of the image).
+    """
+    vmin = min(float(vmin), 0.0)
+    vmax = max(float(vmax), 0.0)
+    if vmin == vmax:
+        return None
+    step = (vmax-vmin)/(n-1)
+    zero = int(round(-vmin/step))
+    return (step, zero, n)
+
+def quantizedValues(grid):
+    """
+    Returns the values of all codes of the grid.
+    """
+    [step, zero, n] = grid
+    return (np.arange(n) - zero)*step
+
+def quantize(data, grid, slab=16):
+    """
+    Returns data as uint16 codes of the grid. The third axis is processed
+    in slabs to keep the temporary arrays small.
+    """
+    [step, zero, n] = grid
+    codes = np.empty(data.shape, dtype=np.uint16)
+    for start in range(0, data.shape[2], slab):
+        tmp = np.divide(data[:,:,start:start+slab], step)
+        np.rint(tmp, out=tmp)
+        np.add(tmp, zero, out=tmp)
+        np.clip(tmp, 0, n-1, out=tmp)
+        codes[:,:,start:start+slab] = tmp
+    return codes
+
+def computeIndices(data, levels, n, out, bufs):
+    """
+    Computes the indices in a color map of length n like myrescaleData and
+    applyLookupTable: Values <= levels[0] get 0, values >= levels[1] get n-1
+    and the values in between are scaled to 1...n-2.
+    """
+    [mini, maxi] = levels
+    if mini == maxi:
+        maxi += 1e-16
+    if mini == maxi:
+        # myrescaleData with scale 1: below is 0, above 1
+        np.greater_equal(data, mini, out=bufs['mask'])
+        np.copyto(out, bufs['mask'])
+        return out
+    scaled = bufs['scaled']
+    mask = bufs['mask']
+    np.subtract(data, mini, out=scaled)
+    np.multiply(scaled, (n-2)/(maxi-mini), out=scaled)
+    np.add(scaled, 1, out=scaled)
+    np.less_equal(data, mini, out=mask)
+    np.copyto(scaled, 0, where=mask)
+    np.greater_equal(data, maxi, out=mask)
+    np.copyto(scaled, n, where=mask)
+    # truncation like astype(int), NaNs end up at 0 after clipping
+    with np.errstate(invalid='ignore'):
+        np.copyto(out, scaled, casting='unsafe')
+    np.clip(out, 0, n-1, out=out)
+    return out
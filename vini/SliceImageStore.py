@@ -0,0 +1,40 @@
+import weakref
+
+
+class SharedImage(object):
+    """
+    A rendered QImage held by every ImageItemMod that displays it.
+    """
+
+    def __init__(self, qimage):
+        self.qimage = qimage
+
+
+class SliceImageStore(object):
+    """
+    Shares the rendered QImages of colored slices between the ImageItemMods
+    of the main window, the extra windows and the popouts, so that a slice
+    shown in several views is converted only once.
+
+    Slices are identified by their version (see Image.getSliceVersion).
+    The store only keeps weak references: the items showing a slice hold
+    it, and it is dropped as soon as the last of them shows another slice
+    or is deleted.
+    """
+
+    def __init__(self):
+        self.images = weakref.WeakValueDictionary()
+
+    def get(self, version, render):
+        """
+        Returns the SharedImage of the slice version. If no item holds it,
+        it is created from the QImage returned by render (if not None).
+        """
+        shared = self.images.get(version)
+        if shared is None:
+            qimage = render()
+            if qimage is None:
+                return None
+            shared = SharedImage(qimage)
+            self.images[version] = shared
+        return shared
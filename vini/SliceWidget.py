@@ -10,6 +10,7 @@ from .pyqtgraph_vini import ItemGroup
 
 from .SliceBox import *
 from .ImageItemMod import *
+from .sliceCompositing import compositeSlices
 
 
 class SliceWidget(GraphicsLayoutWidget):
@@ -24,6 +25,8 @@ class SliceWidget(GraphicsLayoutWidget):
     sigMouseOver = QtCore.Signal(list)
     # Slice focused.
     sigSelected = QtCore.Signal()
+    # Pyramid level needed for the current zoom changed.
+    sigLevelChanged = QtCore.Signal()
 
     def __init__(self, slice_type='c'):
 
@@ -45,6 +48,14 @@ class SliceWidget(GraphicsLayoutWidget):
 
         self.image_count = 0
         self.slice = slice_type
+        self.pyramid_level = None
+
+        # ImageItemMods of the images and, when compositing, the item that
+        # shows them composited into one image (see updateComposite)
+        self.image_items = []
+        self.compositing = False
+        self.composite = None
+        self.composite_key = None
 
         # foreground to catch mouse drag event
         self.foreground = ImageItemMod()
@@ -52,6 +63,9 @@ class SliceWidget(GraphicsLayoutWidget):
         self.initWidget()
         self.initCrosshair()
 
+        self.sb.sigRangeChanged.connect(self.updatePyramidLevel)
+        self.sb.sigResized.connect(self.updatePyramidLevel)
+
     def zoomIn(self):
         self.sb.zoom(0.9)
 
@@ -68,6 +82,26 @@ class SliceWidget(GraphicsLayoutWidget):
             QtGui.QPainter.CompositionMode_SourceOver)
         self.foreground.setImage(np.zeros((100,100,4)))
 
+    def getPyramidLevel(self):
+        """
+        Returns the coarsest pyramid level of the slices that is still sharp
+        at the current zoom or None if the widget isn't shown. Level l has
+        every 2**l-th voxel, so it is used when 2**l voxels fall into one
+        device pixel.
+        """
+        if not self.isVisible() or self.sb.pixelVectors()[0] is None:
+            return None
+        size = min(self.sb.viewPixelSize())
+        if not size >= 2:
+            return 0
+        return int(np.log2(size))
+
+    def updatePyramidLevel(self, *args):
+        level = self.getPyramidLevel()
+        if level != self.pyramid_level:
+            self.pyramid_level = level
+            self.sigLevelChanged.emit()
+
     def keyPressEvent(self, event):
         if type(event) == QtGui.QKeyEvent:
             # print(event.key())
@@ -197,10 +231,17 @@ class SliceWidget(GraphicsLayoutWidget):
         """
         self.sb.addItem(image_item)
         image_item.sigImageChanged.connect(self.update)
-        self.image_dimensions[0:1] = image_item.image.shape
+        self.image_items.append(image_item)
+        image_item.setVisible(not self.compositing)
+        # The slice of the item is coarser at pyramid levels > 0, the
+        # dimensions set by setImageDimensions are kept then.
+        level = image_item.pyramid_level
+        if level == 0 or not all(self.image_dimensions[0:2]):
+            self.image_dimensions[0:2] = [
+                n * 2**level for n in image_item.image.shape[0:2]]
         # Resizing foreground might not be necessary.
-        self.foreground.setImage(
-            np.zeros((self.image_dimensions[0],self.image_dimensions[1],4)))
+        self.foreground.setImage(np.zeros(
+            (int(self.image_dimensions[0]), int(self.image_dimensions[1]), 4)))
         if self.image_count is 0:
             self.foreground.sigMouseDrag.connect(self.CrosshairMoved)
             self.foreground.scene().sigMouseMoved.connect(
@@ -214,12 +255,74 @@ class SliceWidget(GraphicsLayoutWidget):
         """
         self.image_count -= 1
         self.sb.removeItem(image_item)
+        if image_item in self.image_items:
+            self.image_items.remove(image_item)
         if self.image_count is 0:
             self.foreground.sigMouseDrag.disconnect()
             self.foreground.scene().sigMouseMoved.disconnect()
             self.foreground.scene().sigMouseClicked.disconnect()
         self.update()
 
+    ## Compositing ##
+    def showEvent(self, ev):
+        super(SliceWidget, self).showEvent(ev)
+        self.updateComposite()
+
+    def setCompositing(self, state):
+        """
+        Sets whether the images are composited into one image instead of
+        being painted over each other by Qt.
+        """
+        if state == self.compositing:
+            return
+        self.compositing = state
+        self.composite_key = None
+        if state and self.composite is None:
+            self.composite = ImageItemMod()
+            # above the images, below the foreground and the crosshair
+            self.composite.setZValue(1)
+            self.sb.addItem(self.composite)
+        for item in self.image_items:
+            item.setVisible(not state)
+        if self.composite is not None:
+            self.composite.setVisible(state)
+        self.updateComposite()
+
+    def updateComposite(self):
+        """
+        Composites the slices of the images in the order of their z values
+        if one of them changed. Falls back to painting the items one by
+        one if their slices don't fit onto each other.
+        """
+        if not self.compositing or not self.isVisible():
+            # hidden widgets are composited when they are shown
+            return
+        items = [item for item in self.image_items
+                 if item.prerendered and item.image is not None]
+        items.sort(key=lambda item: item.zValue())
+        shapes = set(item.image.shape for item in items)
+        levels = set(item.pyramid_level for item in items)
+        if len(items) == 0 or len(shapes) != 1 or len(levels) != 1:
+            self.composite_key = None
+            self.composite.setVisible(False)
+            for item in self.image_items:
+                item.setVisible(True)
+            return
+        for item in self.image_items:
+            item.setVisible(False)
+        self.composite.setVisible(True)
+
+        key = tuple((item.slice_version, item.paintMode) for item in items)
+        if key == self.composite_key:
+            return
+        self.composite_key = key
+        image = compositeSlices(
+            [(item.image, item.paintMode) for item in items])
+        # Widgets with the same layers share the rendered image.
+        if any(item.slice_version is None for item in items):
+            key = None
+        self.composite.setSlice(image, key, items[0].pyramid_level)
+
     def useMenu(self, menu):
         self.sb.useMyMenu(menu)
 
@@ -0,0 +1,100 @@
+from .pyqtgraph_vini.Qt import QtCore
+import sys
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+
+class TaskScheduler(QtCore.QObject):
+    """
+    Runs expensive functions in a pool of worker threads and delivers their
+    results on the Qt main thread.
+
+    Every task has a key. Submitting a new task with the key of an older one
+    supersedes the older task: it is skipped if it didn't start yet and its
+    result is dropped otherwise. This way only the most recent request (e.g.
+    for the current crosshair position) is delivered.
+    """
+
+    # key, result
+    sigFinished = QtCore.Signal(object, object)
+    # key, exception
+    sigFailed = QtCore.Signal(object, object)
+    # used internally to get from the worker threads to the main thread
+    sigDone = QtCore.Signal(object, object, object, object, bool)
+
+    def __init__(self, n_threads=0):
+        super(TaskScheduler, self).__init__()
+
+        if n_threads <= 0:
+            n_threads = multiprocessing.cpu_count()
+        self.pool = ThreadPool(n_threads)
+
+        # The generation of the latest task of every key that is still
+        # pending. A task is stale if its key has another generation or none
+        # (cancelled). Generations are unique, so a cancelled task doesn't
+        # become current again when its key is submitted later.
+        self.generation = {}
+        self.generations = itertools.count(1)
+
+        # Queued connection: sigDone is emitted in the worker threads.
+        self.sigDone.connect(self.deliver, QtCore.Qt.QueuedConnection)
+
+    def submit(self, key, func, args=(), callback=None):
+        """
+        Runs func(*args) in a worker thread and calls callback(result) on the
+        main thread when it is done.
+
+        Tasks with the same key that were submitted before are superseded.
+        """
+        gen = next(self.generations)
+        self.generation[key] = gen
+
+        def run():
+            if self.generation.get(key) != gen:
+                return
+            try:
+                result = func(*args)
+            except Exception as e:
+                self.sigDone.emit(key, gen, callback, e, True)
+                return
+            self.sigDone.emit(key, gen, callback, result, False)
+
+        self.pool.apply_async(run)
+
+    def cancel(self, key):
+        """
+        Cancels the task with the given key if it is still pending.
+        """
+        self.generation.pop(key, None)
+
+    def cancelAll(self):
+        for key in list(self.generation.keys()):
+            self.cancel(key)
+
+    def isPending(self, key):
+        return key in self.generation
+
+    def deliver(self, key, gen, callback, result, failed):
+        """
+        Called on the main thread with the result of a task.
+        """
+        if self.generation.get(key) != gen:
+            # superseded or cancelled in the meantime
+            return
+        del self.generation[key]
+        if failed:
+            sys.stderr.write(
+                "TaskScheduler: task {} failed: {}\n".format(key, result))
+            self.sigFailed.emit(key, result)
+            return
+        if callback is not None:
+            callback(result)
+        self.sigFinished.emit(key, result)
+
+    def close(self):
+        """
+        Cancels all pending tasks and stops the worker threads.
+        """
+        self.cancelAll()
+        self.pool.terminate()
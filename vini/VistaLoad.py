@@ -5,6 +5,7 @@ vista loader, native python implementation
 
 import scipy.io as sio
 import numpy as np
+from mmap import mmap as memory_map, ACCESS_COPY
 import subprocess
 import nibabel as nib
 import re
@@ -42,25 +43,60 @@ def get_subheader(header, section_demark):
             idx_stop = j+1
             break
     return header[idx_start:idx_stop]
+
+def get_image_data(raw, dict_image, count):
+    """
+    Returns the data of an image as flat array. Vista data is big-endian,
+    so the array is a view of raw with big-endian dtype instead of a
+    byteswapped copy. Bit images are unpacked.
+    """
+    if dict_image["repn"] == "bit":
+        img1D_byterepn = np.frombuffer(raw, dtype=np.uint8, count=dict_image["length"], offset=dict_image["offset"])
+        return np.unpackbits(img1D_byterepn)[0:count]
+    dtype = np.dtype(dict_image["dtype"]).newbyteorder('>')
+    return np.frombuffer(raw, dtype=dtype, count=dict_image["length"], offset=dict_image["offset"])
+
+def get_stacked_images(raw, list_imagedict, shape):
+    """
+    Returns the images (each of the given shape) stacked along a new first
+    axis. If they are evenly spaced in raw this is a strided view of it,
+    otherwise the images are copied.
+    """
+    first = list_imagedict[0]
+    offsets = [d["offset"] for d in list_imagedict]
+    step = offsets[1] - offsets[0]
+    dtype = np.dtype(first["dtype"]).newbyteorder('>')
+    count = int(np.prod(shape))
+    size = count*dtype.itemsize
+    if (first["repn"] != "bit" and step >= size and
+            all(d["repn"] == first["repn"] for d in list_imagedict) and
+            all(b - a == step for a, b in zip(offsets[:-1], offsets[1:]))):
+        strides = (step, shape[1]*shape[2]*dtype.itemsize,
+                   shape[2]*dtype.itemsize, dtype.itemsize)
+        return np.ndarray((len(offsets),) + tuple(shape), dtype=dtype,
+                          buffer=raw, offset=offsets[0], strides=strides)
+    return np.stack([
+        get_image_data(raw, d, count).reshape(shape) for d in list_imagedict])
     
     
 #%% reader
 
 
-def load_vista(fp_input):
+def load_vista(fp_input, mmap=True):
+    """
+    Loads a vista file as Nifti1Image. With mmap the data is a view of the
+    memory-mapped file (copy-on-write), otherwise it is read into memory.
+    """
     
     with open(fp_input, 'rb') as f:
-        raw=f.read()
+        raw = memory_map(f.fileno(), 0, access=ACCESS_COPY)
     
     #find the ^L breaker, determining where the header part stops
-    last_idx_header = -1
-    for i in range(len(raw)):
-        if raw[i:i+2]==b'\x0c\n':
-            last_idx_header = i+2
-            break
+    last_idx_header = raw.find(b'\x0c\n')
     
     if last_idx_header == -1:
         raise ValueError("WARNING! BAD VISTA FILE? {}".format(fp_input))
+    last_idx_header += 2
     #now parse the header for the first time to load the data.
     header = raw[0:last_idx_header-2].decode("utf-8")
     
@@ -134,18 +170,12 @@ def load_vista(fp_input):
         zdim = dict_image["nbands"]
         tdim = 1
         
-        if dict_image["repn"] != "bit": #default case
-            img1D = np.frombuffer(raw, dtype=dict_image["dtype"], count=dict_image["length"], offset=dict_image["offset"]).byteswap()
-        else: #bit representation (masks etc)
-            img1D_byterepn = np.frombuffer(raw, dtype=np.uint8, count=dict_image["length"], offset=dict_image["offset"])#.byteswap()
-            img1D_bit_graced = np.unpackbits(img1D_byterepn)
-            img1D = img1D_bit_graced[0:xdim*ydim*zdim]
+        img1D = get_image_data(raw, dict_image, xdim*ydim*zdim)
             
         img3D = np.transpose(np.reshape(img1D, (zdim,ydim,xdim)), (2,1,0))
         data = img3D
         dim = "3D"
     else:
-        list_images = []
         zdim = len(list_imagedict)
         for i in range(len(idx_images)):
             dict_image = list_imagedict[i]
@@ -171,34 +201,21 @@ def load_vista(fp_input):
             
         
             if dict_image["repn"] != "bit": #default case
-                img1D = np.frombuffer(raw, dtype=dict_image["dtype"], count=dict_image["length"], offset=dict_image["offset"]).byteswap()
-            else: #bit representation (masks etc)
-                img1D_byterepn = np.frombuffer(raw, dtype=np.uint8, count=dict_image["length"], offset=dict_image["offset"])#.byteswap()
-                img1D_bit_graced = np.unpackbits(img1D_byterepn)
-                img1D = img1D_bit_graced[0:xdim*ydim*tdim]
-                # print("count is: {}, img1D.size {} img1D_bit_graced.size {}".format(dict_image["length"], img1D.size, img1D_bit_graced.size))
-                
-            if xdim*ydim*tdim != img1D.size:
-                raise ValueError("Problem with image {}: xdim*ydim*tdim = {}x{}x{} = {}. however length in header was {}".format(i, xdim, ydim, tdim, xdim*ydim*tdim, img1D.size))
+                length = dict_image["length"]
+            else: #bit representation (masks etc), 8 voxels per byte
+                length = min(8*dict_image["length"], xdim*ydim*tdim)
                 
-            # list_images.append(np.frombuffer(raw, dtype=dict_image["dtype"], count=dict_image["length"], offset=dict_image["offset"]).byteswap())
-            list_images.append(img1D)
+            if xdim*ydim*tdim != length:
+                raise ValueError("Problem with image {}: xdim*ydim*tdim = {}x{}x{} = {}. however length in header was {}".format(i, xdim, ydim, tdim, xdim*ydim*tdim, length))
         
-        
-        
-            
-
-        
-        img1D = np.zeros(xdim*ydim*zdim*tdim, dtype=dict_image["dtype"])
-        for i in range(len(idx_images)):
-            # print("i {}, shape {}".format(i, list_images[i].shape))
-            img1D[i*xdim*ydim*tdim:(i+1)*xdim*ydim*tdim] = list_images[i]
-            
-            
-        img4D = np.transpose(np.reshape(img1D, (zdim,tdim,ydim,xdim)), (3,2,0,1))
+        # one image per slice: a (lazy) view (zdim,tdim,ydim,xdim) of them
+        img4D = np.transpose(get_stacked_images(raw, list_imagedict, (tdim,ydim,xdim)), (3,2,0,1))
         data = img4D
         dim = "4D"
         
+    if not mmap:
+        data = np.array(data, dtype=data.dtype.newbyteorder('='))
+        
         
     #%% re-parse the header to get the complete header information
     nii_loaded = nib.Nifti1Image(data, affine=np.eye(4))
@@ -0,0 +1,144 @@
+"""
+Cache of decompressed copies of gzipped images.
+
+Opening a .nii.gz file means decompressing all of it every time. The cache
+keeps an uncompressed copy of every opened file, which can be memory-mapped
+by nibabel. Copies are keyed by path, modification time and size of the
+original, so a changed file gets a new copy. The least recently used copies
+are deleted when the cache gets larger than its size limit.
+
+Files that are too large for the cache are recognized from their header
+without decompressing them, or otherwise remembered by a marker file after
+the first attempt.
+"""
+import os
+import gzip
+import time
+import hashlib
+import tempfile
+
+import numpy as np
+from nibabel import Nifti1Header, Nifti2Header
+
+
+def defaultCacheDir():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'vini')
+
+def cacheKey(filename):
+    """
+    Returns the name of the copy of the file in the cache.
+    """
+    stat = os.stat(filename)
+    key = "{}:{}:{}".format(
+        os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.nii'
+
+def getCachedFile(filename, cache_dir=None, max_size=4096):
+    """
+    Returns the path of the uncompressed copy of the gzipped file, creating
+    it if needed, or None if it is larger than the cache (max_size in MB).
+    """
+    if cache_dir is None:
+        cache_dir = defaultCacheDir()
+    path = os.path.join(cache_dir, cacheKey(filename))
+    if os.path.exists(path):
+        # the modification time marks the last use
+        os.utime(path, None)
+        return path
+    max_bytes = max_size*1024*1024
+    # holds the limit the file exceeded
+    too_large = path + '.large'
+    if os.path.exists(too_large):
+        with open(too_large) as f:
+            if max_bytes <= int(f.read() or 0):
+                return None
+    expected = expectedSize(filename)
+    if expected is not None and expected > max_bytes:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Each loader writes its own copy, the same file might be loaded by
+    # several threads at once. The last complete copy replaces the others.
+    [fd, tmp_path] = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        size = 0
+        with os.fdopen(fd, 'wb') as f_out:
+            with gzip.open(filename, 'rb') as f_in:
+                while True:
+                    block = f_in.read(1024*1024)
+                    if not block:
+                        break
+                    size += len(block)
+                    if size > max_bytes:
+                        break
+                    f_out.write(block)
+        if size > max_bytes:
+            # the header was wrong or missing, don't try again
+            os.remove(tmp_path)
+            with open(too_large, 'w') as f:
+                f.write(str(max_bytes))
+            return None
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict(cache_dir, max_bytes, keep=path)
+    return path
+
+def expectedSize(filename):
+    """
+    Returns the size of the uncompressed file computed from its NIfTI
+    header, or None if the header can't be read.
+    """
+    try:
+        with gzip.open(filename, 'rb') as f:
+            data = f.read(540)
+        for header_class in [Nifti1Header, Nifti2Header]:
+            if len(data) < header_class.sizeof_hdr:
+                continue
+            header = header_class(data[:header_class.sizeof_hdr], check=False)
+            if int(header['sizeof_hdr']) != header_class.sizeof_hdr:
+                continue
+            n = int(np.prod(header.get_data_shape(), dtype=np.int64))
+            return (int(header.get_data_offset()) +
+                    n*header.get_data_dtype().itemsize)
+    except Exception:
+        pass
+    return None
+
+def evict(cache_dir, max_bytes, keep=None, stale_age=24*3600):
+    """
+    Deletes the least recently used copies and markers until the cache is
+    not larger than max_bytes. The file keep is never deleted. Temporary
+    copies older than stale_age seconds were left by crashed runs and are
+    deleted, too.
+    """
+    files = []
+    now = time.time()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # deleted by another loader in the meantime
+            continue
+        if name.endswith('.tmp'):
+            if now - stat.st_mtime > stale_age:
+                removeFile(path)
+        elif name.endswith('.nii') or name.endswith('.large'):
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(f[1] for f in files)
+    for [mtime, size, path] in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        removeFile(path)
+        total -= size
+
+def removeFile(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,44 @@
+"""
+Statistics of image volumes in one pass over the data.
+
+The data is processed in slabs along the last axis (slices of a volume,
+frames of a time series), which are contiguous in NIfTI files. Every slab
+is read once, so memory-mapped files are read only once and no temporary
+arrays of the size of the whole volume are needed.
+"""
+import numpy as np
+
+
+def computeExtremum(data, slab=8):
+    """
+    Returns minimum and maximum of data.
+    """
+    vmin = None
+    vmax = None
+    for start in range(0, data.shape[-1], slab):
+        chunk = data[..., start:start+slab]
+        cmin = chunk.min()
+        cmax = chunk.max()
+        if vmin is None or cmin < vmin:
+            vmin = cmin
+        if vmax is None or cmax > vmax:
+            vmax = cmax
+    return [vmin, vmax]
+
+def computeHistogram(data, bins, slab=8):
+    """
+    Returns the histogram of the nonzero values of data, i.e. the counts of
+    np.histogram(data[data!=0], bins), and the number of nonzero values.
+    There is no masked copy of the data: the zeros of every slab are
+    counted and removed from their bin.
+    """
+    counts = np.zeros(len(bins)-1, dtype=np.int64)
+    nonzero = 0
+    zero_bin = np.histogram([0], bins)[0]
+    for start in range(0, data.shape[-1], slab):
+        chunk = data[..., start:start+slab]
+        counts += np.histogram(chunk, bins)[0]
+        chunk_nonzero = np.count_nonzero(chunk)
+        counts -= (chunk.size - chunk_nonzero)*zero_bin
+        nonzero += chunk_nonzero
+    return [counts, nonzero]
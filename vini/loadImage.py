@@ -22,6 +22,7 @@ from .ImageDialog import *
 from .Image3D import *
 from .Image4D import *
 from .VistaLoad import load_vista
+from .gzCache import getCachedFile
 
 # try:
 #     import pyvista
@@ -50,25 +51,70 @@ def calculateQFormAffine(pixdim, qform_code, quats):
     out[0:3, 3] = [quats[3], quats[4], quats[5]]
     return out
 
-def setPreferences(image, hdr, pref, f_type):
+def scrubNonFinite(data, slab=4):
+    """
+    Sets NaNs and infinite values to zero in one pass over the data. The
+    last axis (frames or slices, the outermost in NIfTI files) is processed
+    in slabs so that the temporary mask stays small. Memory-mapped data is
+    changed in place (copy-on-write) and only copied if it is read-only.
+
+    Returns the scrubbed data and its minimum and maximum, which are
+    computed in the same pass (see computeExtremum).
+    """
+    scrub = data.dtype.kind in 'fc'
+    mask = None
+    vmin = None
+    vmax = None
+    for start in range(0, data.shape[-1], slab):
+        chunk = data[..., start:start+slab]
+        if scrub:
+            if mask is None or mask.shape != chunk.shape:
+                mask = np.empty(chunk.shape, dtype=bool)
+            np.isfinite(chunk, out=mask)
+            np.logical_not(mask, out=mask)
+            if mask.any():
+                if not data.flags.writeable:
+                    data = np.array(data)
+                    chunk = data[..., start:start+slab]
+                chunk[mask] = 0
+        cmin = chunk.min()
+        cmax = chunk.max()
+        if vmin is None or cmin < vmin:
+            vmin = cmin
+        if vmax is None or cmax > vmax:
+            vmax = cmax
+    return [data, [vmin, vmax]]
+
+def getImageData(image):
+    """
+    Returns the data of the nibabel image with NaNs and infinite values set
+    to zero and its minimum and maximum.
+
+    The array behind the image is used directly: for lazily loaded files
+    this is a np.memmap and get_data() would copy it into memory. It is
+    handed to the image class so that the file is not read a second time.
+    """
+    return scrubNonFinite(np.asanyarray(image.dataobj))
+
+def setPreferences(image, hdr, pref, f_type, data=None, extremum=None):
     color_cm = False
     if f_type != 0:
         color_cm = True
-    
-    # if data contain NaNs convert to zero
-    if np.isnan(image.get_data()).any():
-        notnan = image.get_data()
-        notnan[np.isnan(image.get_data())] = 0
-        image = Nifti2Image(notnan, image.affine)
+
+    if data is None:
+        [data, extremum] = getImageData(image)
 
     # allow 2d-images here:
-    if len(image.get_data().shape) == 2:
-       image = Nifti2Image(np.atleast_3d(image.get_data()), image.affine)
+    if len(image.shape) == 2:
+       data = np.atleast_3d(data)
+       image = Nifti2Image(data, image.affine)
 
-    if len(image.get_data().shape) == 3:
-        img = Image3D(image=image, color=color_cm)
-    elif len(image.get_data().shape) == 4:
-        img = Image4D(image=image, color=color_cm)
+    if len(image.shape) == 3:
+        img = Image3D(
+            image=image, color=color_cm, data=data, extremum=extremum)
+    elif len(image.shape) == 4:
+        img = Image4D(
+            image=image, color=color_cm, data=data, extremum=extremum)
         frame_time = hdr['pixdim'][4]
         if frame_time > 15:
             frame_time = frame_time/1000
@@ -102,12 +148,17 @@ def setPreferences(image, hdr, pref, f_type):
             img.setClippingsNeg(pref['clip_neg_low'], pref['clip_neg_high'])
             img.setInterpolation(pref['interpolation'])
 
+    img.setOnDemand(pref['res_on_demand'])
+    img.setQuantized(pref['quantize'])
+    if img.type_d() == "4D":
+        img.setFrameCacheSize(pref['frame_cache'])
+
     img.writeProps()
     return img
 
 def loadImageFromNifti(fileobject, pref, f_type):
     try:
-        image = Nifti2Image(fileobject.get_data(), fileobject.affine)
+        image = fileobject
         hdr = fileobject.header
     except RuntimeError:
             print("Cannot load Nifti object!")
@@ -133,28 +184,53 @@ def loadImageFromNumpyFile(filename):
 
 
 
-def loadImageFromFile(filename, pref, f_type):
+def getUncompressedFile(filename, pref):
+    """
+    Returns the uncompressed copy of a gzipped file from the cache if the
+    cache is enabled, otherwise the filename.
+    """
+    if not pref['gz_cache'] or not filename.endswith('.gz'):
+        return filename
+    try:
+        cached = getCachedFile(filename, max_size=pref['gz_cache_size'])
+    except (OSError, IOError) as e:
+        print("Cannot cache {}: {}".format(filename, e))
+        return filename
+    if cached is None:
+        return filename
+    return cached
+
+def readImageFile(filename, pref):
+    """
+    Reads the file and returns the nibabel image, its header, its data and
+    its minimum and maximum (see getImageData) or None if the file type is
+    unknown.
+
+    This doesn't create any widgets, so it can run in a worker thread.
+    """
+
+    # With lazy loading the nibabel image keeps its array proxy, which
+    # gives a np.memmap for uncompressed files. Only the voxels needed are
+    # read from disk instead of copying the whole file into memory.
+    lazy = pref['lazy_loading']
 
     filetype = os.path.splitext(filename)[1]
     if (filetype=='.nii' or filetype=='.gz'):
         try:
-            temp_img = load(filename)
-            image = Nifti2Image(temp_img.get_data(), temp_img.affine)
-            hdr = temp_img.header
+            image = load(getUncompressedFile(filename, pref), mmap=lazy)
+            hdr = image.header
         except RuntimeError:
             print("Cannot load .nii or nii.gz file: {}".format(filename))
     elif (filetype=='.hdr' or filetype=='.img'):
         try:
-            temp_img = load(filename)
-            image = Nifti2Image(temp_img.get_data(), temp_img.affine)
-            image.dataobj[np.isnan(image.dataobj)] = 0
-            hdr = temp_img.header
+            image = load(filename, mmap=lazy)
+            hdr = image.header
         except RuntimeError:
             print("Cannot load img/hdr pair file: {}".format(filename))
 
     elif (filetype == '.v'):
         try:
-            image = load_vista(filename)
+            image = load_vista(filename, mmap=lazy)
             hdr = image.header
         except RuntimeError:
             print("Cannot load vista file: {}".format(filename))
@@ -173,7 +249,22 @@ def loadImageFromFile(filename, pref, f_type):
     
     # import pdb; pdb.set_trace()
 
-    img = setPreferences(image, hdr, pref, f_type)
+    return [image, hdr] + getImageData(image)
+
+def loadImageFromFile(filename, pref, f_type, loaded=None):
+    """
+    Returns the image class for the file. 'loaded' is the result of
+    readImageFile if the file was already read.
+    """
+    if loaded is None:
+        loaded = readImageFile(filename, pref)
+    if loaded is None:
+        return
+    [image, hdr, data, extremum] = loaded
+
+    img = setPreferences(image, hdr, pref, f_type, data, extremum)
     img.filename = filename
+    if pref['time_major'] and img.type_d() == "4D":
+        img.setTimeMajorSource(filename)
 
     return img
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Search for extrema and local peaks of image volumes.
+
+The local search only looks at a view of the cube around a coordinate, so
+no part of the volume is copied. Peaks are all voxels that are the maximum
+(or minimum) of their 3x3x3 neighborhood without being part of a flat
+region. They are sorted once, so stepping from peak to peak is a lookup.
+"""
+import numpy as np
+from scipy import ndimage
+
+
+def searchCube(data, coord, radius, maxima=True):
+    """
+    Returns the coordinate of the maximum (or minimum) of data within the
+    cube of the given radius around coord.
+    """
+    start = [max(0, int(c)-radius) for c in coord]
+    stop = [min(int(c)+radius, n) for [c, n] in zip(coord, data.shape)]
+    cube = data[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+    if maxima:
+        index = cube.argmax()
+    else:
+        index = cube.argmin()
+    return [int(i) + s for [i, s] in
+            zip(np.unravel_index(index, cube.shape), start)]
+
+def findExtremum(data, maxima=True):
+    """
+    Returns the coordinate of the maximum (or minimum) of data.
+    """
+    if maxima:
+        index = data.argmax()
+    else:
+        index = data.argmin()
+    return [int(i) for i in np.unravel_index(index, data.shape)]
+
+def findPeaks(data, maxima=True, max_peaks=10000):
+    """
+    Returns the coordinates of the local maxima (or minima) of data as
+    (n, 3) array, the highest maxima (lowest minima) first. Only the
+    max_peaks strongest ones are kept.
+    """
+    data = np.asarray(data)
+    upper = ndimage.maximum_filter(data, size=3, mode='nearest')
+    lower = ndimage.minimum_filter(data, size=3, mode='nearest')
+    # flat neighborhoods (e.g. background) have no peaks
+    if maxima:
+        is_peak = np.logical_and(data == upper, data > lower)
+    else:
+        is_peak = np.logical_and(data == lower, data < upper)
+    del upper, lower
+    coords = np.argwhere(is_peak)
+    values = data[is_peak]
+    if len(values) > max_peaks:
+        if maxima:
+            strongest = np.argpartition(values, -max_peaks)[-max_peaks:]
+        else:
+            strongest = np.argpartition(values, max_peaks-1)[:max_peaks]
+        coords = coords[strongest]
+        values = values[strongest]
+    order = np.argsort(values, kind='stable')
+    if maxima:
+        order = order[::-1]
+    return coords[order]
@@ -12,7 +12,46 @@ import scipy as sp
 from scipy import ndimage, linalg
 from distutils.version import LooseVersion, StrictVersion
 
-def resample_image(data, affine, shape, interpolation):
+def resample_image(data, affine, shape, interpolation, output=None):
+    """
+    Resamples data to the grid 'shape', where the voxel coordinates of the
+    grid are mapped to voxel coordinates of data by 'affine'.
+
+    Affines that only scale, flip, swap and translate the axes are resampled
+    axis by axis (see resample_separable), all others with
+    ndimage.affine_transform.
+    """
+    shape = tuple(np.asarray(shape).astype(int))
+
+    if output is None:
+        result = np.empty(
+            shape, dtype=resampled_dtype(data.dtype, interpolation))
+    else:
+        result = output
+
+    perm = get_axis_permutation(affine[0:3,0:3])
+    if perm is not None and interpolation in (0, 1):
+        resample_separable(data, affine, shape, interpolation, perm, result)
+    else:
+        resample_generic(data, affine, shape, interpolation, result)
+
+    return result
+
+def resampled_dtype(dtype, interpolation):
+    """
+    Returns the dtype for resampling data of 'dtype'. Nearest neighbor
+    interpolation only copies values, so the dtype is kept. Otherwise
+    float32 is used unless the data is more precise than that.
+    """
+    dtype = np.dtype(dtype)
+    if interpolation == 0 and (dtype.kind in 'iu' or
+                               (dtype.kind == 'f' and dtype.itemsize >= 4)):
+        return dtype.newbyteorder('=')
+    if dtype.itemsize > 4 or (dtype.kind in 'iu' and dtype.itemsize > 2):
+        return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+def resample_generic(data, affine, shape, interpolation, output=None):
 
     A = affine[0:3,0:3]
     b = affine[0:3,3]
@@ -26,7 +65,10 @@ def resample_image(data, affine, shape, interpolation):
 
     shape = tuple(np.asarray(shape).astype(int))
 
-    result = np.empty(shape,  dtype=float)
+    if output is None:
+        result = np.empty(shape,  dtype=float)
+    else:
+        result = output
     
     
     with warnings.catch_warnings():
@@ -35,6 +77,144 @@ def resample_image(data, affine, shape, interpolation):
 
     return result
 
+def get_axis_permutation(A):
+    """
+    Returns p with p[i] the axis of the output grid that the input axis i
+    depends on, if every row and column of A has exactly one nonzero entry
+    (scaling, flipping and swapping of axes). Returns None otherwise.
+    """
+    nonzero = A != 0
+    if not (np.all(nonzero.sum(axis=0) == 1) and
+            np.all(nonzero.sum(axis=1) == 1)):
+        return None
+    return [int(np.flatnonzero(nonzero[i])[0]) for i in range(3)]
+
+def resample_separable(data, affine, shape, interpolation, perm, output):
+    """
+    Resamples like ndimage.affine_transform (constant mode, cval 0) for
+    affines with an axis permutation 'perm' (see get_axis_permutation).
+
+    Every input axis only depends on one output axis, so the axes are
+    interpolated one after another with 1D interpolation. Integer steps with
+    nearest neighbor interpolation are just slicing.
+    """
+    tmp = data
+    # shrinking axes first keeps the intermediate arrays small
+    order = sorted(range(3), key=lambda i: float(shape[perm[i]])/data.shape[i])
+    for i in order:
+        j = perm[i]
+        coords = affine[i,j]*np.arange(shape[j]) + affine[i,3]
+        tmp = interpolate_axis(tmp, i, coords, interpolation)
+    # the axes of tmp are those of data, move them to the output axes
+    inverse = [0]*3
+    for i in range(3):
+        inverse[perm[i]] = i
+    output[...] = np.transpose(tmp, inverse)
+    return output
+
+def interpolate_axis(data, axis, coords, interpolation):
+    """
+    Returns data interpolated at 'coords' along 'axis' (nearest neighbor
+    for interpolation 0, linear for 1). Coordinates outside of 0...n-1 give 0.
+    """
+    n = data.shape[axis]
+    valid = np.logical_and(coords >= 0, coords <= n-1)
+    if interpolation == 1:
+        lower = np.floor(coords)
+        weight = coords - lower
+        if np.any(weight[valid] != 0):
+            lower = np.clip(lower, 0, n-1).astype(np.intp)
+            upper = np.minimum(lower+1, n-1)
+            bcast = [np.newaxis]*data.ndim
+            bcast[axis] = slice(None)
+            weight = weight[tuple(bcast)]
+            result = np.take(data, lower, axis=axis)*(1-weight)
+            result += np.take(data, upper, axis=axis)*weight
+            return mask_axis(result, axis, valid)
+        # all coordinates are on voxels
+        index = lower
+    else:
+        index = np.floor(coords + 0.5)
+    index = np.clip(index, 0, n-1).astype(np.intp)
+    sl = [slice(None)]*data.ndim
+    sl[axis] = get_slice(index, valid)
+    if sl[axis] is not None:
+        return data[tuple(sl)]
+    return mask_axis(np.take(data, index, axis=axis), axis, valid)
+
+def get_slice(index, valid):
+    """
+    Returns a slice equivalent to the index array if all indices are valid
+    and evenly spaced, otherwise None.
+    """
+    if not np.all(valid):
+        return None
+    if len(index) == 1:
+        return slice(index[0], index[0]+1)
+    step = index[1] - index[0]
+    if step == 0 or np.any(np.diff(index) != step):
+        return None
+    stop = index[-1] + step
+    if stop < 0:
+        stop = None
+    return slice(index[0], stop, step)
+
+def mask_axis(data, axis, valid):
+    """
+    Sets the entries along 'axis' where valid is False to 0.
+    """
+    if not np.all(valid):
+        sl = [slice(None)]*data.ndim
+        sl[axis] = np.logical_not(valid)
+        data[tuple(sl)] = 0
+    return data
+
+def split_slabs(shape, n_slabs):
+    """
+    Splits the third axis of 'shape' into at most 'n_slabs' ranges of
+    similar size and returns them as a list of (start, stop) tuples.
+    """
+    bounds = np.linspace(0, int(shape[2]), n_slabs+1).astype(int)
+    return [(bounds[i], bounds[i+1]) for i in range(n_slabs)
+            if bounds[i+1] > bounds[i]]
+
+def resample_slab(data, affine, shape, interpolation, start, stop, result):
+    """
+    Resamples the slab start:stop along the third axis of the output grid
+    'shape' directly into result[:,:,start:stop].
+    """
+    s_affine = np.copy(affine)
+    s_affine[0:3,3] += affine[0:3,2]*start
+    s_shape = np.asarray(shape).astype(int)
+    s_shape[2] = stop - start
+
+    resample_image(data, s_affine, s_shape, interpolation,
+                   output=result[:,:,start:stop])
+
+def resample_plane(data, affine, shape, plane, index, interpolation, step=1):
+    """
+    Resamples only the plane 'index' along axis 'plane' of the output grid
+    'shape' and returns it as a 2D array.
+
+    The plane is computed by moving the offset of the affine to the plane
+    and resampling a grid that is one voxel thick in that direction. With a
+    step only every step-th voxel along the other axes is resampled, which
+    gives the same as slicing the full plane with [::step, ::step].
+    """
+    p_affine = np.copy(affine)
+    p_affine[0:3,3] += affine[0:3,plane]*index
+    p_shape = np.asarray(shape).astype(int)
+    p_shape[plane] = 1
+    if step > 1:
+        for axis in range(3):
+            if axis != plane:
+                p_affine[0:3,axis] *= step
+                p_shape[axis] = (p_shape[axis] + step - 1)//step
+
+    result = resample_image(data, p_affine, p_shape, interpolation)
+
+    return np.take(result, 0, axis=plane)
+
 if __name__ == "__main__":
 
     # small test of scipy's ndimage.affine_transform
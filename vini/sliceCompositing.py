@@ -0,0 +1,56 @@
+"""
+Compositing of the colored slices of several images into one image.
+
+QPainter blends every ImageItem of a view onto the ones below on each
+paint. Compositing the slices once with NumPy gives the same picture in
+one image, so panning and zooming only redraw that image.
+"""
+import numpy as np
+
+from .pyqtgraph_vini.Qt import QtGui
+
+
+def compositeSlices(layers):
+    """
+    Returns the BGRA image of the layers painted over each other like
+    QPainter does: layers is a list of (slice, composition mode) with BGRA
+    slices of the same shape (see SliceColorizer), the bottom one first.
+    CompositionMode_Plus adds a layer, all other modes are treated as
+    CompositionMode_SourceOver.
+
+    Like the slices the result is an (x, y, channel) array with contiguous
+    rows.
+    """
+    # (y, x, channel), contiguous for the slices
+    shape = layers[0][0].shape[1::-1]
+    # premultiplied colors and alpha in 0...1
+    color = np.zeros(shape + (3,), dtype=np.float32)
+    alpha = np.zeros(shape, dtype=np.float32)
+    src = np.empty(shape + (3,), dtype=np.float32)
+    src_alpha = np.empty(shape, dtype=np.float32)
+    inv_alpha = np.empty(shape, dtype=np.float32)
+    for [image, mode] in layers:
+        image = image.transpose((1, 0, 2))
+        np.multiply(image[...,3], 1.0/255, out=src_alpha)
+        np.multiply(image[...,0:3], src_alpha[...,np.newaxis], out=src)
+        src *= 1.0/255
+        if mode == QtGui.QPainter.CompositionMode_Plus:
+            color += src
+            np.minimum(color, 1, out=color)
+            alpha += src_alpha
+            np.minimum(alpha, 1, out=alpha)
+        else:
+            np.subtract(1, src_alpha, out=inv_alpha)
+            color *= inv_alpha[...,np.newaxis]
+            color += src
+            alpha *= inv_alpha
+            alpha += src_alpha
+
+    # back to colors that are not premultiplied (QImage.Format_ARGB32)
+    np.divide(color, alpha[...,np.newaxis], out=color,
+              where=alpha[...,np.newaxis] > 0)
+    result = np.empty(shape + (4,), dtype=np.ubyte)
+    np.rint(color*255, out=color)
+    result[...,0:3] = color
+    result[...,3] = np.rint(alpha*255)
+    return result.transpose((1, 0, 2))
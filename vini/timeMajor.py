@@ -0,0 +1,59 @@
+"""
+Time-major copies of 4D images.
+
+NIfTI files store the frames one after another, so the time course of a
+single voxel is spread over the whole file. The copy built here stores the
+time course of every voxel contiguously (C order with time as last axis) in
+a .npy file next to the source file, so that time courses are one short
+read from a memory map.
+"""
+import os
+import numpy as np
+
+
+def timeMajorPath(filename):
+    """
+    Returns the path of the time-major copy of the file.
+    """
+    return filename + '.tmajor.npy'
+
+def loadTimeMajor(filename, shape, dtype):
+    """
+    Returns the memory-mapped time-major copy of the file or None if there
+    is none or if it is older than the file or doesn't fit the data.
+    """
+    path = timeMajorPath(filename)
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(filename):
+            return None
+        data = np.load(path, mmap_mode='r')
+    except (OSError, IOError, ValueError):
+        return None
+    if data.shape != tuple(shape) or data.dtype != dtype:
+        return None
+    return data
+
+def buildTimeMajor(data, filename, slab=8):
+    """
+    Writes the time-major copy of the 4D array data of the file and returns
+    it memory-mapped. The third axis is copied in slabs so that only a few
+    slices are in memory at once.
+
+    The copy is written to a temporary file first, so that an interrupted
+    build never leaves a broken copy behind.
+    """
+    path = timeMajorPath(filename)
+    tmp_path = path + '.tmp'
+    out = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=data.dtype, shape=data.shape)
+    try:
+        for start in range(0, data.shape[2], slab):
+            out[:,:,start:start+slab,:] = data[:,:,start:start+slab,:]
+        out.flush()
+        del out
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return np.load(path, mmap_mode='r')
@@ -47,6 +47,9 @@ import time
 import copy
 import sys
 import os.path
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 # for saving preferences
 if sys.version_info[0] == 3:
     from configparser import SafeConfigParser as ConfigParser
@@ -71,10 +74,13 @@ from .loadImage import *
 from .ImageItemMod import *
 from .SliceWindow import *
 from .ValueWindow import *
+from .ClusterTable import ClusterTable
 from .HistogramThresholdWidget import *
 from .SettingsDialog import *
 from .MosaicDialog import *
 from .MosaicView import *
+from .TaskScheduler import TaskScheduler
+from .ResampleCache import ResampleCache
 # for functional movie mode:
 from .JumpSlider import JumpSlider
 # testing input
@@ -171,6 +177,14 @@ class Viff(QtGui.QMainWindow):
         # 'popouts_ii contains the imageitems for the slice window popouts
         self.popouts_ii = []
 
+        # 'slice_levels' contains the pyramid levels at which the slices of
+        # the three planes are colored, see updateSliceLevels.
+        self.slice_levels = [0, 0, 0]
+
+        # 'peak_rank' is the place of the last visited peak in the list of
+        # local maxima, see goToPeak.
+        self.peak_rank = None
+
         ## Extra Windows ##
         # 'image_window_list' is the list of lists of lists containing for each
         # image a list of windows-lists containing slice image items (for each
@@ -203,6 +217,10 @@ class Viff(QtGui.QMainWindow):
         self.playstate = False
         self.slicestate = False
         self.playrate = 3
+        # direction of frame changes (+1/-1) to prefetch the right frames
+        self.play_direction = 1
+        # times of the last shown frames while playing for the fps label
+        self.play_times = []
         # Because the frame index can be changed from multiple locations and
         # has to be updated in the others the 'frame_write_block' tells you if
         # changes in one location have to be propagated to the others.
@@ -252,6 +270,17 @@ class Viff(QtGui.QMainWindow):
 
         # The histogram window is only initialized if needed
         self.hist = None
+        self.cluster_table = None
+
+        # 'scheduler' runs expensive computations in the background and
+        # delivers the results through signals.
+        self.scheduler = TaskScheduler()
+
+        # 'res_cache' keeps resampled volumes, so that only images whose
+        # resampling changed are resampled again.
+        self.res_cache = ResampleCache(
+            self.preferences['res_cache_size']*1024*1024,
+            self.preferences['res_cache_disk']*1024*1024)
 
         # The ipython qtconsole is only initialized if needed.
         self.console = None
@@ -534,6 +563,11 @@ class Viff(QtGui.QMainWindow):
         self.frame_box.setValidator(QtGui.QDoubleValidator())
         
         button_row_fmri.addWidget(self.frame_box)
+
+        # Label for the achieved frame rate while playing
+        self.fps_label = QtGui.QLabel('')
+        self.fps_label.setToolTip("achieved frames per second")
+        button_row_fmri.addWidget(self.fps_label)
         
         spacer = QtGui.QWidget()
         spacer.setSizePolicy(QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Fixed)
@@ -704,6 +738,13 @@ class Viff(QtGui.QMainWindow):
         self.slice_popouts[1].sw.sigMouseOver.connect(self.MouseMoved)
         self.slice_popouts[2].sw.sigMouseOver.connect(self.MouseMoved)
 
+        # for the zoom
+        self.c_slice_widget.sigLevelChanged.connect(self.updateSliceLevels)
+        self.s_slice_widget.sigLevelChanged.connect(self.updateSliceLevels)
+        self.t_slice_widget.sigLevelChanged.connect(self.updateSliceLevels)
+        for popout in self.slice_popouts:
+            popout.sw.sigLevelChanged.connect(self.updateSliceLevels)
+
         ## keyboard shortcuts ##
         # zooming in
         self.zoom_in = QtGui.QAction('ZoomIn', self)
@@ -775,6 +816,18 @@ class Viff(QtGui.QMainWindow):
         self.prev_frame.setShortcutContext(QtCore.Qt.ApplicationShortcut)
         self.addAction(self.prev_frame)
 
+        # go to next/previous local maximum
+        self.next_peak = QtGui.QAction('next peak', self)
+        self.next_peak.setShortcut(QtGui.QKeySequence('j'))
+        self.next_peak.triggered.connect(self.nextPeak)
+        self.next_peak.setShortcutContext(QtCore.Qt.ApplicationShortcut)
+        self.addAction(self.next_peak)
+        self.prev_peak = QtGui.QAction('previous peak', self)
+        self.prev_peak.setShortcut(QtGui.QKeySequence('Shift+J'))
+        self.prev_peak.triggered.connect(self.prevPeak)
+        self.prev_peak.setShortcutContext(QtCore.Qt.ApplicationShortcut)
+        self.addAction(self.prev_peak)
+
         # play frames
         self.play_func = QtGui.QAction('play functional frames', self)
         self.play_func.setShortcut(QtGui.QKeySequence(' '))
@@ -901,6 +954,13 @@ class Viff(QtGui.QMainWindow):
         openHistogram.triggered.connect(self.openHistogramWindow)
         self.tools_menu.addAction(openHistogram)
 
+        # for opening the table of the clusters beyond the thresholds
+        openClusters = QtGui.QAction('Cluster table', self)
+        openClusters.setShortcut(QtGui.QKeySequence('k'))
+        openClusters.setStatusTip('Open table of suprathreshold clusters')
+        openClusters.triggered.connect(self.openClusterTable)
+        self.tools_menu.addAction(openClusters)
+
         # copy properties
         copyImageProps = QtGui.QAction('Copy image properties', self)
         copyImageProps.setShortcut('c')
@@ -952,9 +1012,28 @@ class Viff(QtGui.QMainWindow):
         if len(filename_list) == 0:
             return
 
+        # The files are read (decompressed, NaNs removed) concurrently. The
+        # images are set up in the given order as soon as their file is read
+        # while the window stays responsive.
+        pool = ThreadPool(min(len(filename_list), multiprocessing.cpu_count()))
+        pending = [
+            pool.apply_async(readImageFile, (unicode(fn), self.preferences))
+            for fn in filename_list]
+        pool.close()
+
+        progress = QtGui.QProgressDialog(
+            "Loading images...", None, 0, len(filename_list), self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
         for i in range(len(filename_list)):
+            while not pending[i].ready():
+                pending[i].wait(0.05)
+                progress.setValue(len([p for p in pending if p.ready()]))
+                QtGui.QApplication.processEvents()
             img = loadImageFromFile(
-                unicode(filename_list[i]), self.preferences, type_list[i])
+                unicode(filename_list[i]), self.preferences, type_list[i],
+                loaded=pending[i].get())
             # Saves the first part of the path as 'prefered_path'.
             self.prefered_path = "/".join(filename_list[i].split('/')[:-1])
             # Connects changes in the image dialog with rerendering the image.
@@ -967,6 +1046,9 @@ class Viff(QtGui.QMainWindow):
                     self.frame_sld.setMaximum(self.time_dim-1)
 
             # Images are always inserted at the beginning.
+            img.setScheduler(self.scheduler)
+            img.setResampleCache(self.res_cache)
+            img.setSliceLevels(self.slice_levels)
             self.images.insert(0, img)
             # By default the image is visible in the main window.
             # Create ImageItemMods here.
@@ -985,6 +1067,9 @@ class Viff(QtGui.QMainWindow):
             # Add image list entry.
             itemname = os.path.split(filename_list[i])[-1]
             self.addToList(itemname)
+            QtGui.QApplication.processEvents()
+        pool.join()
+        progress.close()
         
         self.checkIf2DAndRemovePanes()
 
@@ -1093,6 +1178,9 @@ class Viff(QtGui.QMainWindow):
         self.image_window_list.insert(0, image_item_list_tmp)
         self.popouts_ii.insert(0, image_item_list_tmp_po)
 
+        img.setScheduler(self.scheduler)
+        img.setResampleCache(self.res_cache)
+        img.setSliceLevels(self.slice_levels)
         self.images.insert(0, img)
         self.states.insert(0, True)
 
@@ -1169,6 +1257,9 @@ class Viff(QtGui.QMainWindow):
         self.image_window_list.insert(0, image_item_list_tmp)
         self.popouts_ii.insert(0, image_item_list_tmp_po)
 
+        img.setScheduler(self.scheduler)
+        img.setResampleCache(self.res_cache)
+        img.setSliceLevels(self.slice_levels)
         self.images.insert(0, img)
         self.states.insert(0, True)
 
@@ -1239,6 +1330,9 @@ class Viff(QtGui.QMainWindow):
         self.image_window_list.insert(0, image_item_list_tmp)
         self.popouts_ii.insert(0, image_item_list_tmp_po)
 
+        img.setScheduler(self.scheduler)
+        img.setResampleCache(self.res_cache)
+        img.setSliceLevels(self.slice_levels)
         self.images.insert(0, img)
         self.states.insert(0, True)
 
@@ -1290,7 +1384,7 @@ class Viff(QtGui.QMainWindow):
         max_t = -1
         
         for i in range(len(self.images)):
-            sh = self.images[i].image.get_data().shape
+            sh = self.images[i].image.shape
             if sh[0] > max_c:
                 max_c = sh[0]
             if sh[1] > max_s:
@@ -1526,7 +1620,8 @@ class Viff(QtGui.QMainWindow):
         # resample
         for img in self.images:
             # print("dims: {} affine {}".format(self.img_dims, self.affine))
-            img.resample(shape = self.img_dims, affine = self.affine)
+            img.setResampleAffine(shape = self.img_dims, affine = self.affine)
+        self.resampleImages()
 
         self.transform_ind = 0 # save what transformation was applied
         self.res_affine.setIcon(self.icon_checked)
@@ -1543,14 +1638,17 @@ class Viff(QtGui.QMainWindow):
             self.img_dims = self.images[index].getOriginalDimensions()
             # resample
             for img in self.images:
-                img.resample(shape = self.img_dims, affine = self.affine)
+                img.setResampleAffine(shape = self.img_dims, affine = self.affine)
+            self.resampleImages()
         else: # if for whatever reason the index is < 0 take first image.
             if len(self.images) != 0:
                 self.affine = self.images[0].getAffine()
                 self.img_dims = self.images[0].getOriginalDimensions()
                 # resample
                 for img in self.images:
-                    img.resample(shape = self.img_dims, affine = self.affine)
+                    img.setResampleAffine(
+                        shape = self.img_dims, affine = self.affine)
+                self.resampleImages()
 
         self.transform_ind = 1 # save what transformation was applied
         self.res_affine.setIcon(QtGui.QIcon())
@@ -1582,15 +1680,83 @@ class Viff(QtGui.QMainWindow):
                 np.asarray(img.getOriginalDimensions()).astype(float))
             t_affine = np.eye(4)
             t_affine[0:3,0:3] = np.diag(scale)
-            img.resample_overaffine(
+            img.setResampleOverAffine(
                 shape=self.img_dims, t_affine=np.eye(4), over_affine=t_affine)
             iter_idx += 1
+        self.resampleImages()
 
         self.transform_ind = 2 # save what transformation was applied
         self.res_affine.setIcon(QtGui.QIcon())
         self.res_current.setIcon(QtGui.QIcon())
         self.res_fit.setIcon(self.icon_checked)
 
+    def resampleImages(self):
+        """
+        Resamples all images with the transformations set before.
+
+        The images are resampled in a pool of threads, split into z-slabs
+        if there are less images than threads. A progress dialog allows
+        to cancel. The resampled volumes are only set when all of them
+        are finished. If cancelled, the slices are resampled on demand.
+        """
+        images = []
+        for img in self.images:
+            if img.on_demand:
+                img.reresample()
+                continue
+            cached = img.getCachedResampled()
+            if cached is not None:
+                img.commitResampled(cached)
+            else:
+                images.append(img)
+        if len(images) == 0:
+            return
+
+        n_threads = self.preferences['res_threads']
+        if n_threads <= 0:
+            n_threads = multiprocessing.cpu_count()
+        n_slabs = int(np.ceil(float(n_threads)/len(images)))
+
+        results = []
+        jobs = []
+        for img in images:
+            [result, img_jobs] = img.getResampleJobs(n_slabs)
+            results.append(result)
+            jobs.extend(img_jobs)
+
+        cancel = threading.Event()
+        def run(job):
+            if not cancel.is_set():
+                job()
+
+        pool = ThreadPool(n_threads)
+        pending = [pool.apply_async(run, (job,)) for job in jobs]
+        pool.close()
+
+        progress = QtGui.QProgressDialog(
+            "Resampling images...", "Cancel", 0, len(jobs), self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(500)
+        running = pending
+        while len(running) > 0:
+            running[0].wait(0.05)
+            running = [job for job in running if not job.ready()]
+            progress.setValue(len(jobs)-len(running))
+            if progress.wasCanceled():
+                cancel.set()
+            QtGui.QApplication.processEvents()
+        pool.join()
+        progress.close()
+        # raise errors of the jobs here
+        for job in pending:
+            job.get()
+
+        if cancel.is_set():
+            log1("resampleImages: cancelled, resampling on demand")
+            results = [None]*len(images)
+        for img, result in zip(images, results):
+            img.commitResampled(result)
+
     def resampleToAffineClicked(self):
         self.resampleToAffine()
         self.resamplingAftermath()
@@ -1763,7 +1929,7 @@ class Viff(QtGui.QMainWindow):
         
         index = self.imagelist.currentRow()
         if index >= 0:
-            value_set = np.unique(self.images[index].image.get_data())
+            value_set = np.unique(self.images[index].getData())
             value_set_int = np.round(value_set).astype(np.int)
             delta_int = np.linalg.norm(value_set_int-value_set) / np.float(value_set.size)
             if value_set.size >= 256:
@@ -1968,6 +2134,10 @@ class Viff(QtGui.QMainWindow):
         Refreshes the coordinates used.
         """
         self.updateDisplayCoordinates()
+        # the cluster table lists the coordinates, too
+        if self.cluster_table is not None:
+            self.cluster_table.clear()
+            self.resetClusterTable()
         if self.voxel_coord:
             self.voxel_button.setText("voxel")
         else:
@@ -2030,7 +2200,7 @@ class Viff(QtGui.QMainWindow):
         Should only be called after the img_coord are correctly updated.
         """
         if len(self.images) > 0:
-            shape = self.images[0].image_res.shape
+            shape = self.images[0].getDimensions()
             self.img_coord = np.round(np.multiply(np.asarray(shape),0.5)).astype(int)
             self.setCrosshair()
             
@@ -2155,35 +2325,74 @@ class Viff(QtGui.QMainWindow):
     def updateImageItems(self):
         for index in range(len(self.images)):
             self.updateImageItem(index)
+        self.updateComposites()
 
     def updateImageItem(self, index):
         """
         Resets the image arrays of all ImageItemMods.
+
+        Only the ImageItemMods whose slice changed get the new arrays.
         """
         # treat original vini separately
-        mode = self.images[index].mode
+        image = self.images[index]
+        mode = image.mode
+        arrays = image.getImageArrays()
         for window in range(len(self.image_window_list[index])):
             if self.image_window_list[index][window][0] is not None:
                 # attention: order of indies change
-                self.image_window_list[index][window][0].setImage(
-                    self.images[index].getImageArrays()[1])
-                self.image_window_list[index][window][1].setImage(
-                    self.images[index].getImageArrays()[0])
-                self.image_window_list[index][window][2].setImage(
-                    self.images[index].getImageArrays()[2])
+                self.image_window_list[index][window][0].setSlice(
+                    arrays[1], image.getSliceVersion(1),
+                    image.getSliceLevel(1))
+                self.image_window_list[index][window][1].setSlice(
+                    arrays[0], image.getSliceVersion(0),
+                    image.getSliceLevel(0))
+                self.image_window_list[index][window][2].setSlice(
+                    arrays[2], image.getSliceVersion(2),
+                    image.getSliceLevel(2))
                 for i in range(3):
                     self.image_window_list[index][window][i] \
                         .setCompositionMode(mode)
         if self.popouts_ii[index][0] is not None:
-            self.popouts_ii[index][0].setImage(
-                self.images[index].getImageArrays()[1])
-            self.popouts_ii[index][1].setImage(
-                self.images[index].getImageArrays()[0])
-            self.popouts_ii[index][2].setImage(
-                self.images[index].getImageArrays()[2])
+            self.popouts_ii[index][0].setSlice(
+                arrays[1], image.getSliceVersion(1), image.getSliceLevel(1))
+            self.popouts_ii[index][1].setSlice(
+                arrays[0], image.getSliceVersion(0), image.getSliceLevel(0))
+            self.popouts_ii[index][2].setSlice(
+                arrays[2], image.getSliceVersion(2), image.getSliceLevel(2))
             for i in range(3):
                 self.popouts_ii[index][i].setCompositionMode(mode)
 
+    def updateSliceLevels(self):
+        """
+        Chooses the pyramid level of every plane from the zoom of the views
+        showing it and recolors the slices if a level changed.
+
+        The finest level any of the views needs is used, so slices are
+        colored at about the resolution of the screen and are refined
+        when zooming in.
+        """
+        levels = [0, 0, 0]
+        if self.preferences['slice_pyramid']:
+            # planes of the sagittal, coronal and transversal views
+            widgets = [[self.s_slice_widget, self.slice_popouts[1].sw],
+                       [self.c_slice_widget, self.slice_popouts[0].sw],
+                       [self.t_slice_widget, self.slice_popouts[2].sw]]
+            for window in self.extra_windows:
+                widgets[0].append(window.sw_s)
+                widgets[1].append(window.sw_c)
+                widgets[2].append(window.sw_t)
+            for plane in range(3):
+                found = [w.getPyramidLevel() for w in widgets[plane]]
+                found = [l for l in found if l is not None]
+                if len(found) != 0:
+                    levels[plane] = min(found)
+        if levels == self.slice_levels:
+            return
+        self.slice_levels = levels
+        for img in self.images:
+            img.setSliceLevels(levels)
+        self.updateImages()
+
     def resetZValues(self):
         """
         Reset the Z Values such that the list order defines the reverse order
@@ -2201,6 +2410,28 @@ class Viff(QtGui.QMainWindow):
                 self.popouts_ii[i][1].setZValue(z)
                 self.popouts_ii[i][2].setZValue(z)
             z -= 1
+        self.updateComposites()
+
+    def getSliceWidgets(self):
+        """
+        Returns the SliceWidgets of the main window, the popouts and the
+        extra windows.
+        """
+        widgets = [self.c_slice_widget, self.s_slice_widget,
+                   self.t_slice_widget]
+        widgets += [popout.sw for popout in self.slice_popouts]
+        for window in self.extra_windows:
+            widgets += [window.sw_c, window.sw_s, window.sw_t]
+        return widgets
+
+    def updateComposites(self):
+        """
+        Composites the images of every SliceWidget into one image if this
+        is enabled, see SliceWidget.updateComposite.
+        """
+        for widget in self.getSliceWidgets():
+            widget.setCompositing(self.preferences['composite_slices'])
+            widget.updateComposite()
 
 
     ## Section: Activating and Deactivating Images ##
@@ -2320,6 +2551,7 @@ class Viff(QtGui.QMainWindow):
                     self.image_window_list[img_ind][win_ind][1])
                 self.extra_windows[win_ind-1].sw_t.addImageItem(
                     self.image_window_list[img_ind][win_ind][2])
+            self.updateComposites()
 
     def removeFromSliceWidgets(self, index):
         """
@@ -2352,6 +2584,7 @@ class Viff(QtGui.QMainWindow):
                     self.image_window_list[img_ind][win_ind][1])
                 self.extra_windows[win_ind-1].sw_t.removeImageItem(
                     self.image_window_list[img_ind][win_ind][2])
+            self.updateComposites()
 
 
     #%% Section: Current Image Selection Updates ##
@@ -2453,6 +2686,7 @@ class Viff(QtGui.QMainWindow):
             # If there is a histogram window, update that, too.
             if self.hist is not None:
                 self.resetHistogram()
+            self.resetClusterTable()
             # if image is inactive: disable all controls
             if self.states[index] is not True:
                 self.disableControls()
@@ -2603,6 +2837,10 @@ class Viff(QtGui.QMainWindow):
         window.sw_c.sigMouseOver.connect(self.MouseMoved)
         window.sw_s.sigMouseOver.connect(self.MouseMoved)
         window.sw_t.sigMouseOver.connect(self.MouseMoved)
+        # connect zoom changes
+        window.sw_c.sigLevelChanged.connect(self.updateSliceLevels)
+        window.sw_s.sigLevelChanged.connect(self.updateSliceLevels)
+        window.sw_t.sigLevelChanged.connect(self.updateSliceLevels)
 
         self.updateImageItem(index)
         window_number = len(self.extra_windows)
@@ -2711,6 +2949,7 @@ class Viff(QtGui.QMainWindow):
         self.extra_windows[window].close()
         del self.extra_windows[window]
         self.interlinkWindows(self.link_mode)
+        self.updateSliceLevels()
 
     def printImageWindowList(self):
         """
@@ -2863,6 +3102,7 @@ class Viff(QtGui.QMainWindow):
         Goes to the next frame.
         """
         
+        self.play_direction = 1
         self.frame = self.frame+1
         if self.frame >= self.time_dim:
             self.frame = self.time_dim - 1
@@ -2881,6 +3121,7 @@ class Viff(QtGui.QMainWindow):
         """
         Goes to the previous frame.
         """
+        self.play_direction = -1
         self.frame = self.frame-1
         if self.frame < 0:
             self.frame = 0
@@ -2930,6 +3171,8 @@ class Viff(QtGui.QMainWindow):
             if self.playstate == True:
                 self.play_button.setIcon(self.icon_play)
                 self.playstate = False
+                self.play_times = []
+                self.fps_label.setText('')
                 self.setSliceState(True)
                 # This might not be needed anymore.
                 for i in range(len(self.images)):
@@ -2963,9 +3206,31 @@ class Viff(QtGui.QMainWindow):
                 if self.frame == self.time_dim-1:
                     self.frame = -1
                 self.nextFrame()
+                self.updateFpsLabel()
             finally:
                 self.timer.singleShot(self.playrate, self.playingFunc)
 
+    def updateFpsLabel(self):
+        """
+        Shows the frame rate achieved over the last frames while playing.
+        """
+        self.play_times.append(time.time())
+        self.play_times = self.play_times[-11:]
+        if len(self.play_times) > 1:
+            elapsed = self.play_times[-1] - self.play_times[0]
+            if elapsed > 0:
+                self.fps_label.setText("{:.1f} fps".format(
+                    (len(self.play_times)-1)/elapsed))
+
+    def prefetchFrames(self, image):
+        """
+        Starts coloring the next frames in play direction in the background.
+        """
+        depth = self.preferences['prefetch_frames']
+        frames = [(self.frame + k*self.play_direction) % self.time_dim
+                  for k in range(1, depth+1)]
+        image.prefetchFrames(frames)
+
     def setFrameToBox(self):
         """
         Sets the correct current frame to the line edit.
@@ -3008,6 +3273,7 @@ class Viff(QtGui.QMainWindow):
                     # resample only slices
                     self.images[i].resample_slice(shape=self.img_dims, affine=self.affine)
                     self.updateImageItem(i)
+                    self.prefetchFrames(self.images[i])
                 else:
                     # resample whole frame and slice
                     self.images[i].resample_frame()
@@ -3021,6 +3287,7 @@ class Viff(QtGui.QMainWindow):
         self.setFrameToSlider()
         self.updateCrossIntensityLabel()
         self.refreshMosaicView()
+        self.resetClusterTable()
         log1("setFrame called (self.frame {})".format(self.frame))
         
         
@@ -3118,6 +3385,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
         
     def setPosThresholdFromSliders(self):
@@ -3134,6 +3402,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
         
     def setNegThresholdFromSliders(self):
         """
@@ -3150,6 +3419,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
     def setPosThresholdsFromBoxes(self):
         """
@@ -3174,6 +3444,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
     def setNegThresholdsFromBoxes(self):
         """
@@ -3198,6 +3469,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
     def setThresholdsToHistogram(self):
         """
@@ -3267,6 +3539,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
     def resetNegThresholds(self):
         """
@@ -3283,6 +3556,7 @@ class Viff(QtGui.QMainWindow):
         # Make changes visible.
         self.updateSlices()
         self.updateImageItems()
+        self.resetClusterTable()
 
 
     ## Section: Search Extrema ##
@@ -3306,6 +3580,40 @@ class Viff(QtGui.QMainWindow):
                 self.preferences['search_radius'])
             self.setCrosshair()
 
+    def nextPeak(self):
+        """
+        Goes to the next lower local maximum of the current image.
+        """
+        self.goToPeak(1)
+
+    def prevPeak(self):
+        """
+        Goes to the previous higher local maximum of the current image.
+        """
+        self.goToPeak(-1)
+
+    def goToPeak(self, step):
+        """
+        Moves 'step' places in the list of local maxima of the current
+        image, starting at the highest one if the crosshair isn't on the
+        peak visited last.
+        """
+        index = self.imagelist.currentRow()
+        if index < 0:
+            return
+        peaks = self.images[index].getPeaks()
+        if len(peaks) == 0:
+            return
+        rank = self.peak_rank
+        if (rank is None or rank >= len(peaks) or not np.array_equal(
+                peaks[rank], np.asarray(self.img_coord).astype(int))):
+            rank = 0
+        else:
+            rank = min(max(rank+step, 0), len(peaks)-1)
+        self.peak_rank = rank
+        self.img_coord = [int(c) for c in peaks[rank]]
+        self.setCrosshair()
+
 
     ## Section: Open Slice Popouts ##
     def openSliceC(self):
@@ -3424,20 +3732,95 @@ class Viff(QtGui.QMainWindow):
                 
             if self.hist is None:
                 return
-            self.hist.reset()
             
             self.hist.setTitle(filename)
-            # set Histogram
-            [x, y] = self.images[index].getHistogram()
-            self.hist.setPlot(x,y)
-            # set line regions
-            thresholds = self.images[index].threshold_pos
-            self.hist.LineRegionPos(thresholds[0], thresholds[1])
-            if self.images[index].two_cm:
-                thresholds = self.images[index].threshold_neg
-                self.hist.LineRegionNeg(thresholds[0], thresholds[1])
-            # y_range = self.images[index].getYRangeApprox()
-            # self.hist.setRange(y_range[1]*1.2)
+            # set Histogram, computed in the background
+            image = self.images[index]
+            [compute, commit] = image.getHistogramTask()
+            self.scheduler.submit(
+                'histogram', compute,
+                callback=lambda result: self.setHistogramPlot(
+                    image, commit(result)))
+
+    def setHistogramPlot(self, image, hist):
+        """
+        Sets the histogram computed for image if it is still selected.
+        """
+        index = self.imagelist.currentRow()
+        if self.hist is None or index < 0 or self.images[index] is not image:
+            return
+        [x, y] = hist
+        self.hist.setPlot(x,y)
+        # set line regions
+        thresholds = image.threshold_pos
+        self.hist.LineRegionPos(thresholds[0], thresholds[1])
+        if image.two_cm:
+            thresholds = image.threshold_neg
+            self.hist.LineRegionNeg(thresholds[0], thresholds[1])
+        else:
+            self.hist.removeLineRegionNeg()
+        # y_range = self.images[index].getYRangeApprox()
+        # self.hist.setRange(y_range[1]*1.2)
+
+    def openClusterTable(self):
+        """
+        Opens the table of the clusters of the current image.
+        """
+        if self.cluster_table is None:
+            self.cluster_table = ClusterTable()
+            self.cluster_table.sigClusterSelected.connect(self.goToCluster)
+        self.cluster_table.show()
+        self.resetClusterTable()
+
+    def resetClusterTable(self):
+        """
+        Recomputes the clusters of the current image in the background when
+        its thresholds, the frame or the selection changed.
+        """
+        if self.cluster_table is None or not self.cluster_table.isVisible():
+            return
+        # not for every frame of a movie, the table is updated when it stops
+        if self.playstate:
+            return
+        index = self.imagelist.currentRow()
+        if index < 0:
+            self.scheduler.cancel('clusters')
+            self.cluster_table.setTitle("")
+            self.cluster_table.clear()
+            return
+        image = self.images[index]
+        self.cluster_table.setTitle(image.filename)
+        tasks = [image.getClustersTask(True)]
+        if image.getColorParams()[2] is not None:
+            tasks.append(image.getClustersTask(False))
+        self.scheduler.submit(
+            'clusters', lambda: [compute() for [compute, commit] in tasks],
+            callback=lambda results: self.setClusterTable(
+                image, [commit(result) for [[compute, commit], result] in
+                        zip(tasks, results)]))
+
+    def setClusterTable(self, image, clusters):
+        """
+        Lists the clusters computed for image if it is still selected.
+        """
+        index = self.imagelist.currentRow()
+        if (self.cluster_table is None or index < 0 or
+                self.images[index] is not image):
+            return
+        if self.voxel_coord:
+            transform = image.getVoxelCoords
+        else:
+            transform = lambda m: self.applyTransform(
+                m[0], m[1], m[2], self.affine)
+        self.cluster_table.setClusters(clusters, transform)
+
+    def goToCluster(self, coord):
+        """
+        Moves the crosshair to the peak of the cluster selected in the
+        cluster table.
+        """
+        self.img_coord = coord
+        self.setCrosshair()
 
     def copyImagePropsFunc(self):
         """
@@ -3587,19 +3970,51 @@ class Viff(QtGui.QMainWindow):
         coords = coords.tolist()
         self.mosaic_view = None
         self.mosaic_view = MosaicView(rows, cols)
+        # the slices are computed in the background
+        self.scheduler.submit(
+            'mosaic', self.computeMosaicSlices,
+            (self.getMosaicTasks(plane, coords),),
+            callback=self.showMosaicSlices)
+
+    def getMosaicTasks(self, plane, coords):
+        """
+        Returns the images seen in the main window with the functions
+        computing their mosaic slices (see Image.getMosaicTask).
+        """
+        tasks = []
         for img_ind in range(len(self.images)):
             # check if image is seen in main window
             if self.image_window_list[img_ind][0][0] is not None:
-                # iterate over viewboxes
-                for coord_ind in range(len(coords)):
-                    rgba_slice = self.images[img_ind].mosaicSlice(
-                        plane, coords[coord_ind])
-                    img = ImageItemMod()
-                    img.setImage(rgba_slice)
-                    img.setZValue(-img_ind)
-                    # Use composition mode?
-                    img.setCompositionMode(self.images[img_ind].mode)
-                    self.mosaic_view.viewboxes[coord_ind].addItem(img)
+                image = self.images[img_ind]
+                tasks.append([image, image.getMosaicTask(plane, coords)])
+        return tasks
+
+    def computeMosaicSlices(self, tasks):
+        """
+        Returns the mosaic slices of the tasks of getMosaicTasks as a list
+        of [image, slices]. Runs in a worker thread.
+        """
+        return [[image, task()] for [image, task] in tasks]
+
+    def showMosaicSlices(self, mosaic_slices):
+        """
+        Adds the slices of computeMosaicSlices to the mosaic view.
+        """
+        if self.mosaic_view is None:
+            return
+        for [image, rgba_slices] in mosaic_slices:
+            # the image might have been deleted in the meantime
+            if image not in self.images:
+                continue
+            img_ind = self.images.index(image)
+            # iterate over viewboxes
+            for coord_ind in range(len(rgba_slices)):
+                img = ImageItemMod()
+                img.setImage(rgba_slices[coord_ind])
+                img.setZValue(-img_ind)
+                # Use composition mode?
+                img.setCompositionMode(image.mode)
+                self.mosaic_view.viewboxes[coord_ind].addItem(img)
         self.mosaic_view.show()
 
     def refreshMosaicView(self):
@@ -3622,19 +4037,10 @@ class Viff(QtGui.QMainWindow):
         coords = coords.tolist()
         # self.mosaic_view = None
         # self.mosaic_view = MosaicView.MosaicView(rows, cols)
-        for img_ind in range(len(self.images)):
-            # check if image is seen in main window
-            if self.image_window_list[img_ind][0][0] is not None:
-                # iterate over viewboxes
-                for coord_ind in range(len(coords)):
-                    rgba_slice = self.images[img_ind].mosaicSlice(plane, coords[coord_ind])
-                    img = ImageItemMod()
-                    img.setImage(rgba_slice)
-                    img.setZValue(-img_ind)
-                    # Use composition mode?
-                    img.setCompositionMode(self.images[img_ind].mode)
-                    self.mosaic_view.viewboxes[coord_ind].addItem(img)
-        self.mosaic_view.show()
+        self.scheduler.submit(
+            'mosaic', self.computeMosaicSlices,
+            (self.getMosaicTasks(plane, coords),),
+            callback=self.showMosaicSlices)
         
     #%% export    
     def export(self):
@@ -3784,11 +4190,30 @@ class Viff(QtGui.QMainWindow):
             'clip_pos_low': True,
             'clip_neg_high': True,
             'clip_neg_low': False,
+            'quantize': False, # color slices from uint16 codes
 
             # resampling
             'res_method': 0, # (0 - affine, 1 - image, 2 - fit)
             'interpolation': 1,
             'os_ratio': 1.0,
+            'res_on_demand': False, # resample displayed slices only
+            'res_threads': 0, # 0 - number of cores
+            'res_cache_size': 1024, # MB of resampled volumes kept in memory
+            'res_cache_disk': 0, # MB written to disk if memory is full
+
+            # loading
+            'lazy_loading': True, # memory-map uncompressed files
+            'time_major': False, # time-major copy next to 4D files
+            'gz_cache': False, # uncompressed copies of .gz files
+            'gz_cache_size': 4096, # MB
+
+            # playback
+            'frame_cache': 64, # colored frames kept per image
+            'prefetch_frames': 8, # frames colored ahead of the playhead
+
+            # display
+            'slice_pyramid': False, # color zoomed out slices at lower levels
+            'composite_slices': False, # one composited image per view
 
             # search
             'search_radius': 5
@@ -3798,9 +4223,9 @@ class Viff(QtGui.QMainWindow):
     
     def loadPreferences(self):
         settings = QtCore.QSettings()
-        list_bools = ['voxel_coord', 'clip_under_high', 'clip_under_low', 'clip_pos_high', 'clip_pos_low', 'clip_neg_high', 'clip_neg_low']
+        list_bools = ['voxel_coord', 'clip_under_high', 'clip_under_low', 'clip_pos_high', 'clip_pos_low', 'clip_neg_high', 'clip_neg_low', 'lazy_loading', 'time_major', 'gz_cache', 'res_on_demand', 'quantize', 'slice_pyramid', 'composite_slices']
         list_ints = ['link_mode', 'window_width', 'window_height', 'window_posx', 'window_posy', 'hist_width', 'hist_height', 'hist_posx', 'hist_posy', 
-                     'ts_width', 'ts_height', 'ts_posx', 'ts_posy','interpolation', 'res_method', 'search_radius']
+                     'ts_width', 'ts_height', 'ts_posx', 'ts_posy','interpolation', 'res_method', 'res_threads', 'frame_cache', 'prefetch_frames', 'gz_cache_size', 'res_cache_size', 'res_cache_disk', 'search_radius']
         list_floats = ['os_ratio']
         list_strings = ['cm_under', 'cm_pos', 'cm_neg']
         
@@ -3877,6 +4302,8 @@ class Viff(QtGui.QMainWindow):
         """
         Closes all other windows.
         """
+        self.scheduler.close()
+        self.res_cache.close()
         for img in self.images:
             if img.type_d() == "4D":
                 if img.timeseries is not None:
@@ -3899,6 +4326,8 @@ class Viff(QtGui.QMainWindow):
             self.sr_setting.hide()
         if self.hist is not None:
             self.hist.hide()
+        if self.cluster_table is not None:
+            self.cluster_table.hide()
         if self.mosaic_view is not None:
             self.mosaic_view.hide()
 